@@ -1,7 +1,14 @@
+from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
+from sqlalchemy import delete
+from sqlmodel import Session, col, or_
 import secrets, logging
 
+from ..core.db import engine, write_session
+from ..core.settings import get_settings
+from ..models import AuthSession
+
 router = APIRouter()
 
 # Usuarios de ejemplo
@@ -10,8 +17,15 @@ _USERS = {
     "inspector": {"password": "medileser", "techNumber": 2},
 }
 
-# Sesiones en memoria: token -> payload
-_SESSIONS: dict[str, dict] = {}
+# Sesiones: tabla AuthSession (compartida entre workers), token -> payload.
+# Vencen a los settings.session_ttl_minutes; cada login purga las vencidas.
+
+def _is_expired(sess: AuthSession, now: datetime) -> bool:
+    return sess.expires_at is None or sess.expires_at <= now
+
+def _session_payload(sess: AuthSession) -> dict:
+    return {"user": sess.username, "username": sess.username, "bancoId": sess.banco_id,
+            "token": sess.token, "techNumber": sess.tech_number}
 
 class LoginIn(BaseModel):
     username: str
@@ -34,23 +48,32 @@ def login(payload: LoginIn):
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
     token = secrets.token_urlsafe(24)
-    sess = {"user": username, "username": username, "bancoId": payload.bancoId, 
-            "token": token, "techNumber": u["techNumber"]}
-    _SESSIONS[token] = sess
-    return sess
+    now = datetime.utcnow()
+    sess = AuthSession(token=token, username=username, banco_id=payload.bancoId,
+                       tech_number=u["techNumber"], created_at=now,
+                       expires_at=now + timedelta(minutes=get_settings().session_ttl_minutes))
+    with write_session() as db:
+        db.exec(delete(AuthSession).where(
+            or_(col(AuthSession.expires_at).is_(None), col(AuthSession.expires_at) <= now)
+        ))  # type: ignore[call-overload]
+        db.add(sess)
+        db.commit()
+        db.refresh(sess)
+        return _session_payload(sess)
 
 @router.get("/me", response_model=LoginOut)
 def me(authorization: str | None = Header(default=None)):
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Token requerido")
     token = authorization.split(" ", 1)[1]
-    sess = _SESSIONS.get(token)
-    if not sess:
-        raise HTTPException(status_code=401, detail="Token inválido")
-    # garantizar que tenga ambas claves
-    if "username" not in sess and "user" in sess:
-        sess["username"] = sess["user"]
-    if "user" not in sess and "username" in sess:
-        sess["user"] = sess["username"]
-    return sess
+    with Session(engine) as db:
+        sess = db.get(AuthSession, token)
+        if not sess:
+            raise HTTPException(status_code=401, detail="Token inválido")
+        if not _is_expired(sess, datetime.utcnow()):
+            return _session_payload(sess)
+    with write_session() as db:
+        db.exec(delete(AuthSession).where(col(AuthSession.token) == token))  # type: ignore[call-overload]
+        db.commit()
+    raise HTTPException(status_code=401, detail="Sesión expirada")
     
\ No newline at end of file
@@ -1,14 +1,18 @@
 from fastapi import APIRouter
 
+from ..services.excel_service import get_rules_index
+
 router = APIRouter()
 
 @router.get("")
 def get_catalogs():
+    # Q3/Alcance/PMA salen del mismo índice que valida create_oi y llena el Excel
+    rules = get_rules_index()
     return {
-        "q3": [1.6, 2.5, 4.0, 6.3],
-        "alcance": [ 100, 125, 160, 200, 400, 500],
+        "q3": rules.q3_values,
+        "alcance": rules.alcance_values,
         # PMA: solo en el formulario (no desplegable dentro del Excel)
-        "pma": [10, 16],
+        "pma": sorted(rules.pma_pressure),
         "bancos": [{"id": 3, "name": "Banco 3"}, {"id": 4, "name": "Banco 4"}, 
                    {"id": 5, "name": "Banco 5"},{"id": 6, "name": "Banco 6"},],
     }
@@ -1,44 +1,68 @@
-import re
-from io import BytesIO
-from typing import List, cast
+from datetime import datetime
+from typing import List, Optional, Tuple, cast
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import Session, select
 
-from ..core.db import engine
+from ..core.db import engine, write_session
 from ..models import OI, Bancada
-from ..schemas import OICreate, OIRead, OiWithBancadasRead, BancadaCreate, BancadaRead
-from ..services.excel_service import generate_excel as build_excel_file
-from ..services.rules_service import pma_to_pressure
-from pydantic import BaseModel
+from ..schemas import (
+    ArchiveRequest,
+    ArchiveResult,
+    BancadaCreate,
+    BancadaRead,
+    OICreate,
+    OIRead,
+    OiWithBancadasRead,
+)
+from ..services.archive_service import archive_eligible, archive_oi
+from .oi_common import (
+    BANCADA_BODY_OPENAPI,
+    ExcelRequest,
+    apply_bancada_update,
+    bancada_payload,
+    bancada_response,
+    ensure_editable,
+    excel_response,
+    load_archived_bancadas,
+    new_bancada,
+    new_oi,
+    oi_with_bancadas_read,
+    packed_entries_from_bancadas,
+    packed_entries_from_raw,
+    packed_list_response,
+    packed_oi_response,
+    raw_bancadas_stmt,
+    wants_packed,
+)
 
 router = APIRouter()
 
-
-OI_CODE_RE = re.compile(r"^OI-\d{4}-\d{4}$")
-
 def get_session():
     with Session(engine) as session:
         yield session
 
+def get_write_session():
+    # BEGIN IMMEDIATE: serializa escrituras entre workers (ver core/db.py)
+    with write_session() as session:
+        yield session
+
+def _oi_bancadas(session: Session, oi: OI) -> List[Bancada]:
+    """Bancadas de la OI ordenadas por item; si está archivada se leen del archivo."""
+    if oi.archived_at is not None:
+        return load_archived_bancadas(cast(int, oi.id))
+    rows = list(session.exec(select(Bancada).where(Bancada.oi_id == oi.id)))
+    rows.sort(key=lambda x: (x.item or 0))
+    return rows
+
+def _packed_bancadas(session: Session, oi: OI) -> List[Tuple[dict, Optional[bytes]]]:
+    if oi.archived_at is not None:
+        return packed_entries_from_bancadas(load_archived_bancadas(cast(int, oi.id)))
+    return packed_entries_from_raw(session.exec(raw_bancadas_stmt(cast(int, oi.id))).all())
+
 @router.post("", response_model=OIRead)
-def create_oi(payload: OICreate, session: Session = Depends(get_session)):
-    # Validación estricta del patrón OI
-    if not OI_CODE_RE.match(payload.code):
-        raise HTTPException(status_code=422, detail="Código OI inválido (formato OI-####-YYYY).")
-    presion = pma_to_pressure(payload.pma)
-    if presion is None:
-        raise HTTPException(status_code=422, detail="PMA inválido (solo se aceptan 10 o 16).")
-    oi = OI(
-        code=payload.code,
-        q3=payload.q3,
-        alcance=payload.alcance,
-        pma=payload.pma,
-        presion_bar=presion,
-        banco_id=payload.banco_id,
-        tech_number=payload.tech_number,
-    )
+def create_oi(payload: OICreate, session: Session = Depends(get_write_session)):
+    oi = new_oi(payload)
     session.add(oi)
     session.commit()
     session.refresh(oi)
@@ -56,79 +80,53 @@ def list_oi(limit: int = 50, offset: int = 0, session: Session = Depends(get_ses
     q = select(OI).limit(limit).offset(offset)
     return list(session.exec(q))
 
-class ExcelRequest(BaseModel):
-    password: str
-
-@router.post("/{oi_id}/bancadas", response_model=BancadaRead)
-def add_bancada(oi_id: int, payload: BancadaCreate, session: Session = Depends(get_session)):
+@router.post("/{oi_id}/bancadas", response_model=BancadaRead, openapi_extra=BANCADA_BODY_OPENAPI)
+def add_bancada(oi_id: int, request: Request, payload: BancadaCreate = Depends(bancada_payload), session: Session = Depends(get_write_session)):
     oi = session.get(OI, oi_id)
     if not oi:
         raise HTTPException(status_code=404, detail="OI no encontrada")
-    # Autonumeración segura
+    ensure_editable(oi)
     existing_items = session.exec(
         select(Bancada.item).where(Bancada.oi_id == oi_id)
     ).all()
-    next_item = (max([x or 0 for x in existing_items]) if existing_items else 0) + 1
-    b = Bancada(
-        oi_id=oi_id,
-        item=next_item,
-        medidor=payload.medidor,
-        estado=payload.estado,
-        rows=payload.rows,
-        # Mini-planilla completa de la bancada (si el frontend la envía)
-        rows_data=payload.rows_data,
-    )
+    b = new_bancada(oi_id, list(existing_items), payload)
     session.add(b)
     session.commit()
     session.refresh(b)
-    return BancadaRead.model_validate(b)
+    return bancada_response(b, request)
 
 @router.get("/{oi_id}/with-bancadas", response_model=OiWithBancadasRead)
-def get_oi_with_bancadas(oi_id: int, session: Session = Depends(get_session)):
+def get_oi_with_bancadas(oi_id: int, request: Request, session: Session = Depends(get_session)):
     oi = session.get(OI, oi_id)
     if not oi:
         raise HTTPException(status_code=404, detail="OI no encontrada")
-    rows = list(session.exec(select(Bancada).where(Bancada.oi_id == oi_id)))
-    rows.sort(key=lambda x: (x.item or 0))
-    oi_id_int = cast(int, oi.id)
-    return OiWithBancadasRead(
-        id=oi_id_int,
-        code=oi.code,
-        q3=oi.q3,
-        alcance=oi.alcance,
-        pma=oi.pma,
-        presion_bar=oi.presion_bar,
-        banco_id=oi.banco_id,
-        tech_number=oi.tech_number,
-        bancadas=[BancadaRead.model_validate(b) for b in rows],
-    )
+    if wants_packed(request):
+        return packed_oi_response(oi, _packed_bancadas(session, oi))
+    return oi_with_bancadas_read(oi, _oi_bancadas(session, oi))
 
 # Alias para el frontend: /oi/{id}/full → mismo payload que /with-bancadas
 @router.get("/{oi_id}/full", response_model=OiWithBancadasRead)
-def get_oi_full(oi_id: int, session: Session = Depends(get_session)):
-    return get_oi_with_bancadas(oi_id, session)
+def get_oi_full(oi_id: int, request: Request, session: Session = Depends(get_session)):
+    return get_oi_with_bancadas(oi_id, request, session)
 
-@router.put("/bancadas/{bancada_id}", response_model=BancadaRead)
-def update_bancada(bancada_id: int, payload: BancadaCreate, session: Session = Depends(get_session)):
+@router.put("/bancadas/{bancada_id}", response_model=BancadaRead, openapi_extra=BANCADA_BODY_OPENAPI)
+def update_bancada(bancada_id: int, request: Request, payload: BancadaCreate = Depends(bancada_payload), session: Session = Depends(get_write_session)):
     b = session.get(Bancada, bancada_id)
     if not b:
         raise HTTPException(status_code=404, detail="Bancada no encontrada")
-    b.medidor = payload.medidor
-    b.estado = payload.estado or 0
-    b.rows = payload.rows
-    # Reemplazar grid por la versión más reciente que viene del modal.
-    # Si el frontend aún no envía rows_data, esto quedará en None.
-    b.rows_data = payload.rows_data
+    ensure_editable(cast(OI, session.get(OI, b.oi_id)))
+    apply_bancada_update(b, payload)
     session.add(b)
     session.commit()
     session.refresh(b)
-    return BancadaRead.model_validate(b)
+    return bancada_response(b, request)
 
 @router.delete("/bancadas/{bancada_id}")
-def delete_bancada(bancada_id: int, session: Session = Depends(get_session)):
+def delete_bancada(bancada_id: int, session: Session = Depends(get_write_session)):
     b = session.get(Bancada, bancada_id)
     if not b:
         raise HTTPException(status_code=404, detail="Bancada no encontrada")
+    ensure_editable(cast(OI, session.get(OI, b.oi_id)))
     session.delete(b)
     session.commit()
     return {"ok": True}
@@ -138,22 +136,40 @@ def export_excel(oi_id: int, req: ExcelRequest, session: Session = Depends(get_s
     oi = session.get(OI, oi_id)
     if not oi:
         raise HTTPException(status_code=404, detail="OI no encontrada")
-    bancadas = list(session.exec(select(Bancada).where(Bancada.oi_id == oi_id)))
-    bancadas.sort(key=lambda x: (x.item or 0))
-    # Si la plantilla no encuentra coincidencias exactas en E4/O4, devolver 422 (no 500)
-    try:
-        data, filename = build_excel_file(oi, bancadas, password=req.password)
-    except ValueError as e:
-        raise HTTPException(status_code=422, detail=str(e))
-    return StreamingResponse(
-        BytesIO(data),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    return excel_response(oi, _oi_bancadas(session, oi), req.password)
 
 @router.get("/{oi_id}/bancadas-list", response_model=List[BancadaRead])
-def list_bancadas(oi_id: int, session: Session = Depends(get_session)):
-    rows = list(session.exec(select(Bancada).where(Bancada.oi_id == oi_id)))
-    rows.sort(key=lambda x: (x.item or 0))
+def list_bancadas(oi_id: int, request: Request, session: Session = Depends(get_session)):
+    oi = session.get(OI, oi_id)
+    if wants_packed(request):
+        return packed_list_response(_packed_bancadas(session, oi) if oi else [])
+    rows = _oi_bancadas(session, oi) if oi else []
     # Asegura serialización consistente con el schema
-    return [BancadaRead.model_validate(b) for b in rows]
\ No newline at end of file
+    return [BancadaRead.model_validate(b) for b in rows]
+
+@router.post("/archive", response_model=ArchiveResult)
+def archive_sweep(payload: ArchiveRequest, session: Session = Depends(get_write_session)):
+    """Archiva OIs cerradas y/o más antiguas que `older_than_days` (ver services/archive_service)."""
+    ids = archive_eligible(session, older_than_days=payload.older_than_days, include_closed=payload.include_closed)
+    return ArchiveResult(archived=ids)
+
+@router.post("/{oi_id}/close", response_model=OIRead)
+def close_oi(oi_id: int, session: Session = Depends(get_write_session)):
+    oi = session.get(OI, oi_id)
+    if not oi:
+        raise HTTPException(status_code=404, detail="OI no encontrada")
+    if oi.closed_at is None:
+        oi.closed_at = datetime.utcnow()
+        session.add(oi)
+        session.commit()
+        session.refresh(oi)
+    return oi
+
+@router.post("/{oi_id}/archive", response_model=OIRead)
+def archive_one(oi_id: int, session: Session = Depends(get_write_session)):
+    oi = session.get(OI, oi_id)
+    if not oi:
+        raise HTTPException(status_code=404, detail="OI no encontrada")
+    archive_oi(session, oi)
+    session.refresh(oi)
+    return oi
@@ -0,0 +1,188 @@
+from datetime import datetime
+from typing import List, Optional, Tuple, cast
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from ..core.db import async_session, write_session
+from ..models import OI, Bancada
+from ..schemas import (
+    ArchiveRequest,
+    ArchiveResult,
+    BancadaCreate,
+    BancadaRead,
+    OICreate,
+    OIRead,
+    OiWithBancadasRead,
+)
+from ..services.archive_service import archive_eligible, archive_oi
+from .oi_common import (
+    BANCADA_BODY_OPENAPI,
+    ExcelRequest,
+    apply_bancada_update,
+    bancada_payload,
+    bancada_response,
+    ensure_editable,
+    excel_response,
+    load_archived_bancadas,
+    new_bancada,
+    new_oi,
+    oi_with_bancadas_read,
+    packed_entries_from_bancadas,
+    packed_entries_from_raw,
+    packed_list_response,
+    packed_oi_response,
+    raw_bancadas_stmt,
+    wants_packed,
+)
+
+# Variante async de api/oi.py (settings.async_db): mismas rutas y schemas (piezas comunes
+# en api/oi_common.py), pero los handlers corren en el event loop con AsyncSession
+# (aiosqlite). Todo lo que bloquea (lectura de plantilla, archivo frío, generación del
+# Excel) va al threadpool.
+
+router = APIRouter()
+
+async def get_session():
+    async with async_session() as session:
+        yield session
+
+async def get_write_session():
+    # BEGIN IMMEDIATE: serializa escrituras entre workers (ver core/db.py)
+    async with async_session(write=True) as session:
+        yield session
+
+async def _oi_bancadas(session: AsyncSession, oi: OI) -> List[Bancada]:
+    """Bancadas de la OI ordenadas por item; si está archivada se leen del archivo."""
+    if oi.archived_at is not None:
+        return await run_in_threadpool(load_archived_bancadas, cast(int, oi.id))
+    rows = list(await session.exec(select(Bancada).where(Bancada.oi_id == oi.id)))
+    rows.sort(key=lambda x: (x.item or 0))
+    return rows
+
+async def _packed_bancadas(session: AsyncSession, oi: OI) -> List[Tuple[dict, Optional[bytes]]]:
+    if oi.archived_at is not None:
+        return packed_entries_from_bancadas(await run_in_threadpool(load_archived_bancadas, cast(int, oi.id)))
+    return packed_entries_from_raw((await session.exec(raw_bancadas_stmt(cast(int, oi.id)))).all())
+
+async def _get_oi_or_404(session: AsyncSession, oi_id: int) -> OI:
+    oi = await session.get(OI, oi_id)
+    if not oi:
+        raise HTTPException(status_code=404, detail="OI no encontrada")
+    return oi
+
+@router.post("", response_model=OIRead)
+async def create_oi(payload: OICreate, session: AsyncSession = Depends(get_write_session)):
+    # El índice de reglas puede leer la plantilla del disco
+    oi = await run_in_threadpool(new_oi, payload)
+    session.add(oi)
+    await session.commit()
+    await session.refresh(oi)
+    return oi
+
+@router.get("/{oi_id}", response_model=OIRead)
+async def get_oi(oi_id: int, session: AsyncSession = Depends(get_session)):
+    return await _get_oi_or_404(session, oi_id)
+
+@router.get("", response_model=List[OIRead])
+async def list_oi(limit: int = 50, offset: int = 0, session: AsyncSession = Depends(get_session)):
+    q = select(OI).limit(limit).offset(offset)
+    return list(await session.exec(q))
+
+@router.post("/{oi_id}/bancadas", response_model=BancadaRead, openapi_extra=BANCADA_BODY_OPENAPI)
+async def add_bancada(oi_id: int, request: Request, payload: BancadaCreate = Depends(bancada_payload), session: AsyncSession = Depends(get_write_session)):
+    oi = await _get_oi_or_404(session, oi_id)
+    ensure_editable(oi)
+    existing_items = (await session.exec(
+        select(Bancada.item).where(Bancada.oi_id == oi_id)
+    )).all()
+    b = new_bancada(oi_id, list(existing_items), payload)
+    session.add(b)
+    await session.commit()
+    await session.refresh(b)
+    return bancada_response(b, request)
+
+@router.get("/{oi_id}/with-bancadas", response_model=OiWithBancadasRead)
+async def get_oi_with_bancadas(oi_id: int, request: Request, session: AsyncSession = Depends(get_session)):
+    oi = await _get_oi_or_404(session, oi_id)
+    if wants_packed(request):
+        return packed_oi_response(oi, await _packed_bancadas(session, oi))
+    return oi_with_bancadas_read(oi, await _oi_bancadas(session, oi))
+
+# Alias para el frontend: /oi/{id}/full → mismo payload que /with-bancadas
+@router.get("/{oi_id}/full", response_model=OiWithBancadasRead)
+async def get_oi_full(oi_id: int, request: Request, session: AsyncSession = Depends(get_session)):
+    return await get_oi_with_bancadas(oi_id, request, session)
+
+@router.put("/bancadas/{bancada_id}", response_model=BancadaRead, openapi_extra=BANCADA_BODY_OPENAPI)
+async def update_bancada(bancada_id: int, request: Request, payload: BancadaCreate = Depends(bancada_payload), session: AsyncSession = Depends(get_write_session)):
+    b = await session.get(Bancada, bancada_id)
+    if not b:
+        raise HTTPException(status_code=404, detail="Bancada no encontrada")
+    ensure_editable(cast(OI, await session.get(OI, b.oi_id)))
+    apply_bancada_update(b, payload)
+    session.add(b)
+    await session.commit()
+    await session.refresh(b)
+    return bancada_response(b, request)
+
+@router.delete("/bancadas/{bancada_id}")
+async def delete_bancada(bancada_id: int, session: AsyncSession = Depends(get_write_session)):
+    b = await session.get(Bancada, bancada_id)
+    if not b:
+        raise HTTPException(status_code=404, detail="Bancada no encontrada")
+    ensure_editable(cast(OI, await session.get(OI, b.oi_id)))
+    await session.delete(b)
+    await session.commit()
+    return {"ok": True}
+
+@router.post("/{oi_id}/excel")
+async def export_excel(oi_id: int, req: ExcelRequest, session: AsyncSession = Depends(get_session)):
+    oi = await _get_oi_or_404(session, oi_id)
+    bancadas = await _oi_bancadas(session, oi)
+    # openpyxl es CPU/IO bloqueante: fuera del event loop
+    return await run_in_threadpool(excel_response, oi, bancadas, req.password)
+
+@router.get("/{oi_id}/bancadas-list", response_model=List[BancadaRead])
+async def list_bancadas(oi_id: int, request: Request, session: AsyncSession = Depends(get_session)):
+    oi = await session.get(OI, oi_id)
+    if wants_packed(request):
+        return packed_list_response(await _packed_bancadas(session, oi) if oi else [])
+    rows = await _oi_bancadas(session, oi) if oi else []
+    return [BancadaRead.model_validate(b) for b in rows]
+
+def _archive_sweep_sync(payload: ArchiveRequest) -> List[int]:
+    with write_session() as session:
+        return archive_eligible(session, older_than_days=payload.older_than_days, include_closed=payload.include_closed)
+
+def _archive_one_sync(oi_id: int) -> OI:
+    with write_session() as session:
+        oi = session.get(OI, oi_id)
+        if not oi:
+            raise HTTPException(status_code=404, detail="OI no encontrada")
+        archive_oi(session, oi)
+        session.refresh(oi)
+        return oi
+
+@router.post("/archive", response_model=ArchiveResult)
+async def archive_sweep(payload: ArchiveRequest):
+    """Archiva OIs cerradas y/o más antiguas que `older_than_days` (ver services/archive_service)."""
+    # El servicio de archivo es sync (escribe además en la BD de archivo): se ejecuta en el threadpool
+    ids = await run_in_threadpool(_archive_sweep_sync, payload)
+    return ArchiveResult(archived=ids)
+
+@router.post("/{oi_id}/close", response_model=OIRead)
+async def close_oi(oi_id: int, session: AsyncSession = Depends(get_write_session)):
+    oi = await _get_oi_or_404(session, oi_id)
+    if oi.closed_at is None:
+        oi.closed_at = datetime.utcnow()
+        session.add(oi)
+        await session.commit()
+        await session.refresh(oi)
+    return oi
+
+@router.post("/{oi_id}/archive", response_model=OIRead)
+async def archive_one(oi_id: int):
+    return await run_in_threadpool(_archive_one_sync, oi_id)
@@ -0,0 +1,236 @@
+import json
+import re
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Sequence, Tuple, cast
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import type_coerce
+from sqlmodel import col, select
+
+from ..core.settings import get_settings
+from ..models import OI, Bancada, RawRowsType
+from ..schemas import BancadaCreate, BancadaRead, OICreate, OIRead, OiWithBancadasRead
+from ..services.archive_service import archived_bancadas
+from ..services.excel_service import generate_excel as build_excel_file, get_rules_index
+from ..services.rows_codec import (
+    PACKED_MEDIA_TYPE,
+    can_pack,
+    decode_frame,
+    encode_frame,
+    is_packed,
+    pack_rows,
+    unpack_rows,
+)
+
+# Piezas compartidas por los routers de OI (api/oi.py sync y api/oi_async.py): validación,
+# armado de modelos, negociación JSON/trama empaquetada y respuestas. Nada de aquí abre
+# sesiones ni toca la BD principal; cada router resuelve eso con su propio driver.
+
+
+OI_CODE_RE = re.compile(r"^OI-\d{4}-\d{4}$")
+
+class ExcelRequest(BaseModel):
+    password: str
+
+def _accept_quality(request: Request) -> Dict[str, float]:
+    """Media types del header Accept con su q (q=0 significa "no aceptable")."""
+    out: Dict[str, float] = {}
+    for part in request.headers.get("accept", "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if not media:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media = media.lower()
+        out[media] = max(out.get(media, 0.0), q)
+    return out
+
+def wants_packed(request: Request) -> bool:
+    """Negociación por Accept: el cliente pide la trama binaria (services/rows_codec).
+    Solo si la nombra explícitamente y no prefiere JSON; los comodines siguen dando JSON."""
+    accept = _accept_quality(request)
+    packed = accept.get(PACKED_MEDIA_TYPE, 0.0)
+    json_q = max(accept.get(m, 0.0) for m in ("application/json", "application/*", "*/*"))
+    return packed > 0 and packed >= json_q
+
+# Body de POST/PUT de bancadas: JSON (BancadaCreate) o trama empaquetada según Content-Type
+BANCADA_BODY_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": BancadaCreate.model_json_schema()},
+            PACKED_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+async def bancada_payload(request: Request) -> BancadaCreate:
+    body = await request.body()
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if ctype == PACKED_MEDIA_TYPE:
+            meta, blobs = decode_frame(body)
+            if not isinstance(meta, dict):
+                raise ValueError("Trama empaquetada inválida")
+            size = meta.pop("rows_packed", None)
+            if size is None:
+                if blobs:
+                    raise ValueError("Trama empaquetada inválida")
+            elif not isinstance(size, int) or size != len(blobs):
+                raise ValueError("Trama empaquetada inválida")
+            else:
+                meta["rows_data"] = unpack_rows(blobs)
+            return BancadaCreate.model_validate(meta)
+        return BancadaCreate.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+_BANCADA_READ_FIELDS = ("id", "item", "medidor", "estado", "rows")
+# rows_data tal como está en la BD: los blobs empaquetados se reenvían sin decodificar
+_RAW_BANCADA_COLUMNS = (
+    col(Bancada.id), col(Bancada.item), col(Bancada.medidor), col(Bancada.estado), col(Bancada.rows),
+    type_coerce(col(Bancada.rows_data), RawRowsType()).label("rows_raw"),
+)
+
+def raw_bancadas_stmt(oi_id: int):
+    return select(*_RAW_BANCADA_COLUMNS).where(Bancada.oi_id == oi_id).order_by(col(Bancada.item))
+
+def _packed_entry(fields: Dict[str, Any], rows: Any) -> Tuple[dict, Optional[bytes]]:
+    """Metadatos de una bancada para la trama y su blob (si lo hay). `rows` es el valor crudo
+    de la BD (blob empaquetado o texto JSON legacy) o la lista ya decodificada."""
+    blob: Optional[bytes] = None
+    if is_packed(rows):
+        blob, rows = bytes(rows), None
+    elif isinstance(rows, (str, bytes, bytearray)):
+        rows = json.loads(rows)
+    if rows is not None and can_pack(rows):
+        blob, rows = pack_rows(rows, compress=get_settings().rows_compress), None
+    meta = {**fields, "rows_data": rows}
+    if blob is not None:
+        meta["rows_packed"] = len(blob)
+    return meta, blob
+
+def packed_entries_from_raw(rows: Sequence[Any]) -> List[Tuple[dict, Optional[bytes]]]:
+    return [_packed_entry({k: r._mapping[k] for k in _BANCADA_READ_FIELDS}, r.rows_raw) for r in rows]
+
+def packed_entries_from_bancadas(bancadas: Sequence[Bancada]) -> List[Tuple[dict, Optional[bytes]]]:
+    return [_packed_entry({k: getattr(b, k) for k in _BANCADA_READ_FIELDS}, b.rows_data) for b in bancadas]
+
+def _packed_response(meta: Any, entries: Sequence[Tuple[dict, Optional[bytes]]]) -> Response:
+    blobs = [blob for _, blob in entries if blob is not None]
+    return Response(encode_frame(meta, blobs), media_type=PACKED_MEDIA_TYPE)
+
+def packed_list_response(entries: Sequence[Tuple[dict, Optional[bytes]]]) -> Response:
+    return _packed_response([m for m, _ in entries], entries)
+
+def packed_oi_response(oi: OI, entries: Sequence[Tuple[dict, Optional[bytes]]]) -> Response:
+    meta = OIRead.model_validate(oi, from_attributes=True).model_dump(mode="json")
+    meta["bancadas"] = [m for m, _ in entries]
+    return _packed_response(meta, entries)
+
+def load_archived_bancadas(oi_id: int) -> List[Bancada]:
+    # Fila ausente en la BD de archivo (archive_db_path mal configurado, archivo perdido)
+    try:
+        return archived_bancadas(oi_id)
+    except LookupError:
+        raise HTTPException(status_code=503, detail="OI archivada no disponible")
+
+def ensure_editable(oi: OI) -> None:
+    if oi.archived_at is not None or oi.closed_at is not None:
+        raise HTTPException(status_code=409, detail="OI cerrada, no se puede modificar")
+
+def bancada_response(b: Bancada, request: Request):
+    if wants_packed(request):
+        meta, blob = packed_entries_from_bancadas([b])[0]
+        return _packed_response(meta, [(meta, blob)])
+    return BancadaRead.model_validate(b)
+
+def new_oi(payload: OICreate) -> OI:
+    """Valida el payload contra el patrón y las reglas de la plantilla y arma la OI (sin guardar)."""
+    # Validación estricta del patrón OI
+    if not OI_CODE_RE.match(payload.code):
+        raise HTTPException(status_code=422, detail="Código OI inválido (formato OI-####-YYYY).")
+    # Validar contra las listas de la plantilla (mismo índice que usa el Excel)
+    rules = get_rules_index()
+    presion = rules.pressure_for(payload.pma)
+    if presion is None:
+        permitidos = " o ".join(str(p) for p in sorted(rules.pma_pressure))
+        raise HTTPException(status_code=422, detail=f"PMA inválido (solo se aceptan {permitidos}).")
+    if rules.match_q3(payload.q3) is None:
+        raise HTTPException(status_code=422, detail="Q3 no coincide con la lista de la plantilla")
+    if rules.match_alcance(payload.alcance) is None:
+        raise HTTPException(status_code=422, detail="Alcance no coincide con la lista de la plantilla")
+    oi = OI(
+        code=payload.code,
+        q3=payload.q3,
+        alcance=payload.alcance,
+        pma=payload.pma,
+        presion_bar=presion,
+        banco_id=payload.banco_id,
+        tech_number=payload.tech_number,
+    )
+    return oi
+
+def new_bancada(oi_id: int, existing_items: List[int], payload: BancadaCreate) -> Bancada:
+    # Autonumeración segura
+    next_item = (max([x or 0 for x in existing_items]) if existing_items else 0) + 1
+    return Bancada(
+        oi_id=oi_id,
+        item=next_item,
+        medidor=payload.medidor,
+        estado=payload.estado,
+        rows=payload.rows,
+        # Mini-planilla completa de la bancada (si el frontend la envía)
+        rows_data=payload.rows_data,
+    )
+
+def apply_bancada_update(b: Bancada, payload: BancadaCreate) -> None:
+    b.medidor = payload.medidor
+    b.estado = payload.estado or 0
+    b.rows = payload.rows
+    # Reemplazar grid por la versión más reciente que viene del modal.
+    # Si el frontend aún no envía rows_data, esto quedará en None.
+    b.rows_data = payload.rows_data
+    # Marca la bancada como modificada para el export incremental
+    b.version = (b.version or 1) + 1
+
+def oi_with_bancadas_read(oi: OI, rows: List[Bancada]) -> OiWithBancadasRead:
+    oi_id_int = cast(int, oi.id)
+    return OiWithBancadasRead(
+        id=oi_id_int,
+        code=oi.code,
+        q3=oi.q3,
+        alcance=oi.alcance,
+        pma=oi.pma,
+        presion_bar=oi.presion_bar,
+        banco_id=oi.banco_id,
+        tech_number=oi.tech_number,
+        closed_at=oi.closed_at,
+        archived_at=oi.archived_at,
+        bancadas=[BancadaRead.model_validate(b) for b in rows],
+    )
+
+def excel_response(oi: OI, bancadas: List[Bancada], password: str) -> StreamingResponse:
+    # Si la plantilla no encuentra coincidencias exactas en E4/O4, devolver 422 (no 500)
+    try:
+        data, filename = build_excel_file(oi, bancadas, password=password)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return StreamingResponse(
+        BytesIO(data),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,9 +1,173 @@
 from pathlib import Path
-from sqlmodel import SQLModel, create_engine
+from typing import TYPE_CHECKING, Optional, cast
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session, SQLModel, create_engine
 
-DB_PATH = Path("app/data/vi.db")
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+from .settings import get_settings
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Modo multi-worker (uvicorn --workers N / varios nodos sobre el mismo archivo):
+# cada proceso crea su propio engine al importar este módulo; el estado compartido
+# vive solo en la BD. SQLite coordina a los escritores con:
+#   - journal WAL (lectores no bloquean al escritor); usar "delete" si el archivo
+#     está en un recurso de red, donde WAL no está soportado
+#   - busy_timeout: esperar el lock en vez de fallar de inmediato
+#   - BEGIN IMMEDIATE en transacciones de escritura (ver write_session): el lock de
+#     escritura se toma al inicio, así lectura+escritura (p.ej. autonumeración de
+#     bancadas) no se intercalan entre procesos ni fallan al "subir" el lock.
+_settings = get_settings()
+
+def _configure_sqlite(eng: Engine) -> None:
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_connection, _record) -> None:
+        # Desactivar el BEGIN implícito del driver: lo emite _on_begin
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={_settings.db_journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={int(_settings.db_busy_timeout_ms)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    @event.listens_for(eng, "begin")
+    def _on_begin(conn: Connection) -> None:
+        immediate = conn.get_execution_options().get("sqlite_immediate", False)
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+def make_sqlite_engine(path: Path) -> Engine:
+    """Engine SQLite con la configuración multi-worker descrita arriba."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    eng = create_engine(
+        f"sqlite:///{path}",
+        echo=False,
+        connect_args={"check_same_thread": False, "timeout": _settings.db_busy_timeout_ms / 1000},
+    )
+    _configure_sqlite(eng)
+    return eng
+
+DB_PATH = Path(_settings.db_path)
+engine = make_sqlite_engine(DB_PATH)
+
+# Engine para escrituras: misma conexión/pool, pero con BEGIN IMMEDIATE
+write_engine = engine.execution_options(sqlite_immediate=True)
+
+def write_session() -> Session:
+    """Sesión cuya transacción toma el lock de escritura de SQLite al comenzar."""
+    return Session(write_engine)
+
+# Variante async (settings.async_db): mismo archivo y configuración, driver aiosqlite.
+# Se crea al primer uso, e importa el soporte async de SQLAlchemy (greenlet) recién
+# ahí, para que aiosqlite/greenlet solo sean necesarios si se activa.
+_async_engine: "Optional[AsyncEngine]" = None
+_async_write_engine: "Optional[AsyncEngine]" = None
+
+def get_async_engine() -> "AsyncEngine":
+    global _async_engine, _async_write_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        eng = create_async_engine(
+            f"sqlite+aiosqlite:///{DB_PATH}",
+            echo=False,
+            connect_args={"timeout": _settings.db_busy_timeout_ms / 1000},
+        )
+        _configure_sqlite(eng.sync_engine)
+        _async_engine = eng
+        # Igual que write_engine: misma pool, opción fija para no crearla en cada request
+        _async_write_engine = eng.execution_options(sqlite_immediate=True)
+    return _async_engine
+
+def async_session(write: bool = False) -> "AsyncSession":
+    """AsyncSession sobre el engine async; `write=True` usa BEGIN IMMEDIATE como write_session.
+    expire_on_commit=False: en async no se puede recargar atributos de forma implícita."""
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    eng = get_async_engine()
+    if write:
+        eng = cast("AsyncEngine", _async_write_engine)
+    return AsyncSession(eng, expire_on_commit=False)
+
+def reclaim_space() -> bool:
+    """VACUUM de la BD principal si tiene páginas libres (p.ej. tras archivar OIs) y, en WAL,
+    checkpoint TRUNCATE para que el archivo realmente se achique. No puede correr dentro de
+    una transacción: se usa una conexión propia sin BEGIN. Retorna True si compactó."""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA freelist_count")
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute("VACUUM")
+        if _settings.db_journal_mode == "wal":
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cursor.close()
+        return True
+    finally:
+        conn.close()
+
+def is_locked_error(exc: BaseException) -> bool:
+    """True si la excepción es un "database is locked/busy" de SQLite (agotado busy_timeout)."""
+    msg = str(getattr(exc, "orig", exc)).lower()
+    return "database is locked" in msg or "database is busy" in msg
+
+# Columnas agregadas después de la creación inicial de la BD.
+# create_all no altera tablas existentes, así que se agregan a mano: tabla -> {columna: DDL}
+_ADDED_COLUMNS = {
+    "bancada": {"version": "INTEGER NOT NULL DEFAULT 1"},
+    "oi": {"closed_at": "DATETIME", "archived_at": "DATETIME"},
+    "authsession": {"expires_at": "DATETIME"},
+}
+
+def _ensure_columns(conn: Connection) -> None:
+    insp = inspect(conn)
+    for table, columns in _ADDED_COLUMNS.items():
+        if not insp.has_table(table):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+# Tablas cuyos ids no deben reutilizarse (sqlite_autoincrement en el modelo). Las
+# creadas antes sin AUTOINCREMENT se reconstruyen: SQLite reasigna el mayor id borrado.
+_AUTOINCREMENT_TABLES = ("bancada",)
+
+def _ensure_autoincrement(conn: Connection) -> None:
+    for name in _AUTOINCREMENT_TABLES:
+        ddl = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :n"), {"n": name}
+        ).scalar()
+        if not ddl or "AUTOINCREMENT" in ddl.upper():
+            continue
+        table = SQLModel.metadata.tables[name]
+        old = f"{name}__old"
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+        table.create(conn)
+        existing = {c["name"] for c in inspect(conn).get_columns(old)}
+        cols = ", ".join(c.name for c in table.columns if c.name in existing)
+        # Los ids se copian tal cual; sqlite_sequence queda en el máximo copiado
+        conn.execute(text(f"INSERT INTO {name} ({cols}) SELECT {cols} FROM {old}"))
+        conn.execute(text(f"DROP TABLE {old}"))
+
+def reserve_ids(table: str, min_seq: int) -> None:
+    """Garantiza que los próximos ids AUTOINCREMENT de `table` sean mayores que `min_seq`
+    (p.ej. ids que ya no están en la tabla pero siguen referenciados desde otra BD)."""
+    with write_engine.begin() as conn:
+        seq = conn.execute(
+            text("SELECT seq FROM sqlite_sequence WHERE name = :n"), {"n": table}
+        ).scalar()
+        if seq is None:
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:n, :s)"), {"n": table, "s": min_seq})
+        elif seq < min_seq:
+            conn.execute(text("UPDATE sqlite_sequence SET seq = :s WHERE name = :n"), {"n": table, "s": min_seq})
 
 def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    # Varios workers arrancan a la vez: crear/migrar dentro de una única
+    # transacción de escritura para que no compitan por el mismo DDL.
+    with write_engine.begin() as conn:
+        SQLModel.metadata.create_all(conn)
+        _ensure_columns(conn)
+        _ensure_autoincrement(conn)
@@ -1,15 +1,48 @@
 from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # Orígenes permitidos para CORS
     cors_origins: List[str] = ["http://localhost:5173", "http://127.0.0.1:5173"]
 
+    # Base de datos SQLite (ruta relativa al directorio de trabajo, normalmente backend/)
+    db_path: str = "app/data/vi.db"
+    # Espera máxima por el lock de escritura antes de responder 503 (multi-worker)
+    db_busy_timeout_ms: int = 15000
+    # "wal" en un solo host; "delete" si el archivo se comparte por red entre nodos
+    db_journal_mode: Literal["wal", "delete"] = "wal"
+
+    # Vigencia de los tokens de login (minutos); /auth/me rechaza los vencidos
+    session_ttl_minutes: int = 720
+
+    # Rutas /oi con handlers async (AsyncSession + aiosqlite) en vez de sync en el threadpool
+    async_db: bool = False
+
+    # Archivo de OIs cerradas/antiguas (BD SQLite aparte con bancadas comprimidas)
+    archive_db_path: str = "app/data/vi_archive.db"
+    # Antigüedad (días) a partir de la cual el barrido archiva una OI; None = solo cerradas
+    archive_after_days: Optional[int] = None
+    # OIs archivadas descomprimidas que se mantienen en memoria (LRU)
+    archive_cache_size: int = 32
+
     # Ruta relativa (desde app/) a la plantilla Excel
     data_template_path: str = "data/PLANTILLA_VI.xlsx"
 
+    # Export incremental: conservar el último libro generado por OI y reescribir
+    # solo las bancadas cambiadas. Máximo de OIs en caché (LRU).
+    excel_incremental_export: bool = True
+    excel_cache_max_ois: int = 16
+
+    # Almacenamiento de Bancada.rows_data: "json" (legacy, dicts) o "packed"
+    # (blob binario columnar, ver services/rows_codec). Se leen ambos formatos.
+    # "packed" ocupa ~4-5x menos en disco y en /full empaquetado; cada carga ORM de
+    # rows_data sigue armando los dicts, a un costo similar a json.loads (±15%
+    # en un grid de 2000 filas), así que no acelera exports ni respuestas JSON.
+    rows_storage: Literal["json", "packed"] = "json"
+    rows_compress: bool = True
+
     class Config:
         env_prefix = "VI_"
         env_file = ".env"
@@ -20,6 +53,8 @@ class Settings(BaseSettings):
         base = Path(__file__).resolve().parents[1]  # .../backend/app
         return str((base / self.data_template_path).resolve())
     
+# Caché por proceso: la configuración es de solo lectura (env/.env), así que cada
+# worker obtiene el mismo valor sin necesidad de compartir estado.
 @lru_cache
 def get_settings() -> Settings:
     return Settings()
\ No newline at end of file
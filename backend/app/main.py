@@ -1,8 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import OperationalError
 from app.core.settings import get_settings
 from app.api import catalogs, auth, oi
-from app.core.db import init_db
+from app.core.db import get_async_engine, init_db, is_locked_error
+from app.services.archive_service import reserve_archived_bancada_ids
 
 app = FastAPI(title="VI Backend")
 settings = get_settings()
@@ -15,15 +18,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(OperationalError)
+async def _db_operational_error(request: Request, exc: OperationalError):
+    # Otro worker retuvo el lock de escritura más que busy_timeout: el cliente puede reintentar
+    if is_locked_error(exc):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Base de datos ocupada, reintente"},
+            headers={"Retry-After": "1"},
+        )
+    raise exc
+
 @app.get("/health")
 def health():
     return {"ok": True}
 
 app.include_router(catalogs.router, prefix="/catalogs", tags=["catalogs"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(oi.router, prefix="/oi", tags=["oi"])
+# VI_ASYNC_DB=true: mismas rutas /oi con handlers async (AsyncSession + aiosqlite).
+# Import diferido: el soporte async (greenlet/aiosqlite) solo se carga si se activa.
+if settings.async_db:
+    from app.api import oi_async
+    app.include_router(oi_async.router, prefix="/oi", tags=["oi"])
+else:
+    app.include_router(oi.router, prefix="/oi", tags=["oi"])
 
 @app.on_event("startup")
 def _startup() -> None:
     init_db()
+    reserve_archived_bancada_ids()
+    if settings.async_db:
+        # Falla al arrancar (no en la primera petición) si falta el driver aiosqlite
+        get_async_engine()
     
\ No newline at end of file
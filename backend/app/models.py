@@ -1,8 +1,45 @@
 from datetime import datetime
 from typing import Optional, List
 from sqlmodel import SQLModel, Field, Relationship
+import json
 from sqlalchemy import Column
-from sqlalchemy.types import JSON
+from sqlalchemy.types import Text, TypeDecorator
+
+from .core.settings import get_settings
+from .services.rows_codec import can_pack, is_packed, pack_rows, unpack_rows
+
+
+class RowsDataType(TypeDecorator):
+    """Columna `rows_data`: lista de dicts guardada como JSON (legacy) o como blob empaquetado
+    (ver services/rows_codec) según `settings.rows_storage`. La lectura acepta ambos formatos.
+    impl Text a propósito: la columna guarda texto (JSON) o bytes (empaquetado) y SQLite no
+    convierte blobs por afinidad, así que ambos conviven; un impl binario (LargeBinary)
+    rechazaría el JSON legacy como str."""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        settings = get_settings()
+        if settings.rows_storage == "packed" and can_pack(value):
+            return pack_rows(value, compress=settings.rows_compress)
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if is_packed(value):
+            return unpack_rows(value)
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode("utf-8")
+        return json.loads(value)
+
+class RawRowsType(TypeDecorator):
+    """Lectura cruda de `rows_data`: devuelve lo almacenado (blob empaquetado o texto JSON)
+    sin decodificar, para reenviarlo tal cual al cliente (ver api/oi_common.py)."""
+    impl = Text
+    cache_ok = True
 
 class OI(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -14,10 +51,17 @@ class OI(SQLModel, table=True):
     banco_id: int
     tech_number: int
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Cierre explícito (ya no se edita) y archivado: las bancadas de una OI archivada
+    # viven en la BD de archivo (services/archive_service); aquí queda solo esta fila.
+    closed_at: Optional[datetime] = None
+    archived_at: Optional[datetime] = None
 
     bancadas: List["Bancada"] = Relationship(back_populates="oi")
 
 class Bancada(SQLModel, table=True):
+    # AUTOINCREMENT: ids nunca reutilizados (las bancadas archivadas conservan el suyo)
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id: Optional[int] = Field(default=None, primary_key=True)
     oi_id: int = Field(foreign_key="oi.id")
     item: int                       # autonum (1..n)
@@ -25,11 +69,23 @@ class Bancada(SQLModel, table=True):
     medidor: Optional[str] = None
     estado: int = Field(default=0, ge=0, le=5)  # 0..5 (editable; default 0)
     rows: int = Field(default=15, ge=1)
+    # Versión de la bancada: se incrementa en cada edición (export incremental de Excel)
+    version: int = Field(default=1, ge=1)
     # Grid de filas de la bancada (cada elemento representa una fila del modal/Excel).
-    # Se almacena como JSON (lista de dicts) para conservar la mini-planilla completa.
+    # Se almacena como JSON (lista de dicts) o empaquetado (settings.rows_storage) para conservar la mini-planilla completa.
     rows_data: Optional[List[dict]] = Field(
         default=None,
-        sa_column=Column(JSON)
+        sa_column=Column(RowsDataType)
     )
 
-    oi: Optional[OI] = Relationship(back_populates="bancadas")
\ No newline at end of file
+    oi: Optional[OI] = Relationship(back_populates="bancadas")
+
+class AuthSession(SQLModel, table=True):
+    """Sesión de login (token Bearer). Vive en la BD para que todos los workers la vean."""
+    token: str = Field(primary_key=True)
+    username: str
+    banco_id: int
+    tech_number: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Vencimiento del token; las filas sin valor (anteriores a la columna) cuentan como vencidas
+    expires_at: Optional[datetime] = None
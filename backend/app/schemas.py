@@ -1,4 +1,5 @@
-from typing import Optional, List, Literal, Annotated
+from datetime import datetime
+from typing import Optional, List, Annotated
 from pydantic import BaseModel, Field, ConfigDict, StringConstraints
 
 OI_CODE_PATTERN = r"^OI-\d{4}-\d{4}$"
@@ -8,7 +9,7 @@ class OICreate(BaseModel):
     code: Annotated[str, StringConstraints(pattern=OI_CODE_PATTERN, strip_whitespace=True)]
     q3: float
     alcance: int
-    pma: Literal[10, 16]
+    pma: int  # validado contra RulesIndex (services/rules_service) en create_oi
     banco_id: int
     tech_number: int
 
@@ -21,6 +22,16 @@ class OIRead(BaseModel):
     presion_bar: float
     banco_id: int
     tech_number: int
+    closed_at: Optional[datetime] = None
+    archived_at: Optional[datetime] = None
+
+class ArchiveRequest(BaseModel):
+    # Antigüedad mínima (días) para archivar; None → settings.archive_after_days
+    older_than_days: Optional[int] = Field(default=None, ge=0)
+    include_closed: bool = True
+
+class ArchiveResult(BaseModel):
+    archived: List[int] = Field(default_factory=list)
 
 class BancadaBase(BaseModel):
     medidor: Optional[str] = None
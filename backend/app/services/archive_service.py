@@ -0,0 +1,191 @@
+import copy
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, cast
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    func,
+    inspect,
+    select as sa_select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, col, or_, select
+
+from ..core.db import make_sqlite_engine, reclaim_space, reserve_ids
+from ..core.settings import get_settings
+from ..models import OI, Bancada
+
+# Archivo "frío" de OIs: BD SQLite aparte, una fila por OI con sus bancadas
+# serializadas a JSON y comprimidas. En la BD principal queda solo la fila OI
+# (con archived_at) para listados; las lecturas/exportaciones de bancadas se
+# sirven desde aquí con un LRU de OIs descomprimidas.
+
+_archive_meta = MetaData()
+oi_archive = Table(
+    "oi_archive",
+    _archive_meta,
+    Column("oi_id", Integer, primary_key=True),
+    Column("code", String, nullable=False),
+    Column("archived_at", DateTime, nullable=False),
+    Column("payload", LargeBinary, nullable=False),  # zlib(JSON de la lista de bancadas)
+    # Mayor id de bancada del payload: la BD principal no debe volver a asignarlo
+    Column("max_bancada_id", Integer, nullable=True),
+)
+
+_BANCADA_FIELDS = ("id", "oi_id", "item", "medidor", "estado", "rows", "version", "rows_data")
+
+_engine = None
+_engine_lock = threading.Lock()
+# oi_id -> lista de dicts de bancadas (ya descomprimida)
+_CACHE: "OrderedDict[int, list[dict]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _archive_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            eng = make_sqlite_engine(Path(get_settings().archive_db_path))
+            with eng.begin() as conn:
+                _archive_meta.create_all(conn)
+                existing = {c["name"] for c in inspect(conn).get_columns("oi_archive")}
+                if "max_bancada_id" not in existing:
+                    conn.execute(text("ALTER TABLE oi_archive ADD COLUMN max_bancada_id INTEGER"))
+            _engine = eng
+        return _engine
+
+
+def _encode(bancadas: List[Bancada]) -> bytes:
+    data = [{k: getattr(b, k) for k in _BANCADA_FIELDS} for b in bancadas]
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _decode(payload: bytes) -> list[dict]:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def _cached_rows(oi_id: int) -> Optional[list[dict]]:
+    with _CACHE_LOCK:
+        rows = _CACHE.get(oi_id)
+        if rows is not None:
+            _CACHE.move_to_end(oi_id)
+            return rows
+    with _archive_engine().connect() as conn:
+        payload = conn.execute(
+            sa_select(oi_archive.c.payload).where(oi_archive.c.oi_id == oi_id)
+        ).scalar_one_or_none()
+    if payload is None:
+        return None
+    rows = _decode(payload)
+    with _CACHE_LOCK:
+        _CACHE[oi_id] = rows
+        _CACHE.move_to_end(oi_id)
+        while len(_CACHE) > max(get_settings().archive_cache_size, 1):
+            _CACHE.popitem(last=False)
+    return rows
+
+
+def archived_bancadas(oi_id: int) -> List[Bancada]:
+    """Bancadas de una OI archivada (objetos desligados de cualquier sesión), ordenadas por item."""
+    rows = _cached_rows(oi_id)
+    if rows is None:
+        raise LookupError(f"OI {oi_id} no está en el archivo")
+    # Objetos nuevos en cada llamada: quien los use no puede alterar la caché
+    out = [Bancada(**copy.deepcopy(r)) for r in rows]
+    out.sort(key=lambda b: (b.item or 0))
+    return out
+
+
+def archive_oi(session: Session, oi: OI) -> None:
+    """Mueve las bancadas de `oi` al archivo y deja la OI como stub (archived_at).
+    `session` debe ser de escritura; hace commit."""
+    if oi.archived_at is not None:
+        return
+    oi_id = cast(int, oi.id)
+    bancadas = list(session.exec(select(Bancada).where(Bancada.oi_id == oi_id)))
+    now = datetime.utcnow()
+    # 1) Escribir primero en el archivo: si lo siguiente falla, la fila se reemplaza en el próximo intento
+    max_id = max((cast(int, b.id) for b in bancadas), default=0)
+    stmt = sqlite_insert(oi_archive).values(
+        oi_id=oi_id, code=oi.code, archived_at=now, payload=_encode(bancadas), max_bancada_id=max_id,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[oi_archive.c.oi_id],
+        set_={
+            "code": stmt.excluded.code,
+            "archived_at": stmt.excluded.archived_at,
+            "payload": stmt.excluded.payload,
+            "max_bancada_id": stmt.excluded.max_bancada_id,
+        },
+    )
+    with _archive_engine().begin() as conn:
+        conn.execute(stmt)
+    # 2) Quitar las bancadas de la BD principal y marcar la OI
+    for b in bancadas:
+        session.delete(b)
+    oi.archived_at = now
+    if oi.closed_at is None:
+        oi.closed_at = now
+    session.add(oi)
+    session.commit()
+    with _CACHE_LOCK:
+        _CACHE.pop(oi_id, None)
+
+
+def archive_eligible(session: Session, older_than_days: Optional[int] = None, include_closed: bool = True) -> List[int]:
+    """Archiva las OIs cerradas (si `include_closed`) y las creadas hace más de `older_than_days`
+    días (por defecto settings.archive_after_days). Retorna los ids archivados."""
+    if older_than_days is None:
+        older_than_days = get_settings().archive_after_days
+    conds = []
+    if include_closed:
+        conds.append(col(OI.closed_at).is_not(None))
+    if older_than_days is not None:
+        conds.append(col(OI.created_at) < datetime.utcnow() - timedelta(days=older_than_days))
+    if not conds:
+        return []
+    ois = list(session.exec(select(OI).where(col(OI.archived_at).is_(None), or_(*conds))))
+    archived: List[int] = []
+    for oi in ois:
+        # id antes de archive_oi: leerlo después recargaría la OI y abriría otra transacción
+        oi_id = cast(int, oi.id)
+        archive_oi(session, oi)
+        archived.append(oi_id)
+    # Cerrar la transacción de la consulta: VACUUM no puede esperar al lock de escritura
+    session.commit()
+    # Borrar bancadas solo deja páginas libres; compactar para que vi.db (y sus respaldos) se achiquen.
+    # También recupera lo liberado por archivados individuales (POST /oi/{id}/archive).
+    reclaim_space()
+    return archived
+
+
+def reserve_archived_bancada_ids() -> None:
+    """Sube la secuencia de ids de bancada de la BD principal por encima de los ids archivados.
+    Necesario para bancadas archivadas antes de que la tabla tuviera AUTOINCREMENT: SQLite
+    reasignaba esos ids y un PUT/DELETE sobre ellos alcanzaba la bancada de otra OI."""
+    if not Path(get_settings().archive_db_path).exists():
+        return
+    with _archive_engine().begin() as conn:
+        # Filas archivadas antes de la columna max_bancada_id: calcularla desde el payload
+        legacy = conn.execute(
+            sa_select(oi_archive.c.oi_id, oi_archive.c.payload).where(oi_archive.c.max_bancada_id.is_(None))
+        ).all()
+        for oi_id, payload in legacy:
+            max_id = max((r.get("id") or 0 for r in _decode(payload)), default=0)
+            conn.execute(update(oi_archive).where(oi_archive.c.oi_id == oi_id).values(max_bancada_id=max_id))
+        top = conn.execute(sa_select(func.max(oi_archive.c.max_bancada_id))).scalar()
+    if top:
+        reserve_ids("bancada", top)
@@ -1,3 +1,7 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 from typing import Iterable, Tuple, Optional, cast
@@ -15,7 +19,12 @@ from openpyxl.styles.protection import Protection as CellProtection
 
 from ..models import OI, Bancada
 from ..core.settings import get_settings
-from .rules_service import pma_to_pressure, find_exact_in_range, normalize_for_excel_list
+from .rules_service import (
+    DEFAULT_ALCANCE_VALUES,
+    DEFAULT_Q3_VALUES,
+    RulesIndex,
+    build_rules_index,
+)
 
 
 HEADER_ROW = 8
@@ -80,14 +89,28 @@ def _get_sheet(wb: Workbook, name: str) -> Worksheet:
         active = wb.worksheets[0]
     return cast(Worksheet, active)
 
-def _iter_range_values(ws: Worksheet, range_ref: str) -> list[str]:
-    """Devuelve los valores del rango ya normalizados al formato de la lista (coma y 1 decimal)."""
-    vals: list[str] = []
-    for row in ws[range_ref]:
-        for cell in row:
-            # normalize_for_excel_list puede devolver None → forzamos str
-            vals.append(normalize_for_excel_list(cell.value) or "")
-    return vals
+def _iter_range_raw(ws, range_ref: str) -> list:
+    """Devuelve los valores crudos (no vacíos) del rango."""
+    return [cell.value for row in ws[range_ref] for cell in row if cell.value is not None]
+
+@lru_cache(maxsize=1)
+def _load_rules_index(tpl_path: str, mtime: float) -> RulesIndex:
+    wb = load_workbook(tpl_path, read_only=True, data_only=True)
+    try:
+        ws = wb[SHEET_NAME] if SHEET_NAME in wb.sheetnames else (wb.active or wb.worksheets[0])
+        return build_rules_index(_iter_range_raw(ws, Q3_RANGE), _iter_range_raw(ws, ALCANCE_RANGE))
+    finally:
+        wb.close()
+
+def get_rules_index() -> RulesIndex:
+    """Índice de reglas (Q3, Alcance, PMA→Presión) construido una vez desde las listas de la plantilla.
+    Se reconstruye solo si cambia el archivo; sin plantilla usa las listas por defecto."""
+    tpl = Path(get_settings().template_abs_path)
+    try:
+        mtime = tpl.stat().st_mtime
+    except OSError:
+        return build_rules_index(DEFAULT_Q3_VALUES, DEFAULT_ALCANCE_VALUES)
+    return _load_rules_index(str(tpl), mtime)
 
 def _copy_row_styles(src_ws: Worksheet, src_row: int, dst_ws: Worksheet, dst_row: int, max_col: int) -> None:
     """Replica estilos de la fila `src_row` en `dst_row` (A..max_col).
@@ -149,16 +172,174 @@ def _copy_formulas(ws: Worksheet, src_row: int, dst_row: int, start_col_letter:
                 # Si el destino está mergeado/protegido, omitir
                 pass 
 
-def generate_excel(oi: OI, bancadas: Iterable[Bancada], password: str | None = None) -> Tuple[bytes, str]:
+def _write_bancada_rows(
+    ws: Worksheet,
+    oi: OI,
+    b: Bancada,
+    start_row: int,
+    estado_col: int,
+    medidor_col: int,
+    today_str: str,
+    presion_val: Optional[float],
+    clear_missing: bool = False,
+) -> int:
+    """Escribe las filas de una bancada a partir de `start_row`. Retorna el número de filas escritas.
+    Con `clear_missing=True` (reescritura incremental) los valores ausentes se limpian en vez de omitirse,
+    para no dejar datos de la versión anterior de la bancada."""
+    # 1. Detectar fuente de filas: ¿Tiene data del Grid (rows_data) o es legacy?
+    rows_source = getattr(b, "rows_data", []) or []
+    nrows = _bancada_nrows(b)
+
+    # 2. Iterar fila por fila
+    for k in range(nrows):
+        r = start_row + k
+        # Obtener payload de la fila k (si existe)
+        row_payload = rows_source[k] if (rows_source and k < len(rows_source)) else {}
+
+        # Col A: Item incremental
+        item_value = start_row - DATA_START_ROW + 1 + k
+        ws.cell(row=r, column=1, value=item_value)
+
+        # Col B y C: Fechas
+        ws.cell(row=r, column=2, value=today_str)
+        ws.cell(row=r, column=3, value=today_str)
+
+        # Col D y E: Banco y Técnico
+        ws.cell(row=r, column=4, value=oi.banco_id)
+        ws.cell(row=r, column=5, value=oi.tech_number)
+
+        # Col G: Medidor (Prioridad: Fila > Bancada > Vacío)
+        val_medidor = row_payload.get("medidor") or b.medidor
+        if medidor_col:
+            ws.cell(row=r, column=medidor_col, value=val_medidor or "")
+
+        # --- LÓGICA DE REPLICACIÓN VERTICAL (FILA MAESTRA VS ESCLAVA) ---
+        # Si es la fila base (k=0), escribimos el valor.
+        # Si es fila esclava (k>0), escribimos referencia a la fila anterior (r-1).
+
+        # Col H: Presión (Referencia Vertical)
+        if presion_val is not None:
+            if k == 0:
+                ws.cell(row=r, column=8, value=presion_val)
+            else:
+                ws.cell(row=r, column=8, value=f"=H{r-1}")
+
+        # Col I: Estado (Referencia Vertical según FORMULAS.txt)
+        if k == 0:
+            ws.cell(row=r, column=estado_col, value=(b.estado if b.estado is not None else 0))
+        else:
+            ws.cell(row=r, column=estado_col, value=f"=I{r-1}")
+
+        # --- ESCRITURA DE BLOQUES Q3 / Q2 / Q1 ---
+        def _write_block(start_col, block):
+            # c1..c7 -> offsets 0..6
+            # Columns: c1(Temp), c2(P.In), c3(P.Out), c4(LI), c5(LF), c6(Vol), c7(Time)
+            # Replicar: c1, c2, c3, c6, c7 (Indices 0,1,2,5,6)
+            # NO Replicar (Individuales): c4, c5 (Indices 3,4 -> L.I., L.F.)
+
+            # Índices que deben ser referencia en filas esclavas
+            shared_indices = {0, 1, 2, 5, 6}
+
+            if not block: block = {}
+
+            for idx, key in enumerate(["c1", "c2", "c3", "c4", "c5", "c6", "c7"]):
+                val = block.get(key)
+                target_col = start_col + idx
+                col_letter = get_column_letter(target_col)
+
+                # Regla: Si es fila > 0 Y el campo es compartido, poner fórmula "=J9"
+                if k > 0 and idx in shared_indices:
+                    ws.cell(row=r, column=target_col, value=f"={col_letter}{r-1}")
+                else:
+                    # Fila 0 o campo individual (LI/LF) -> Escribir valor
+                    if val is not None:
+                        ws.cell(row=r, column=target_col, value=val)
+                    elif clear_missing:
+                        # ws.cell(value=None) no sobrescribe: limpiar explícitamente
+                        ws.cell(row=r, column=target_col).value = None
+
+        _write_block(10, row_payload.get("q3")) # J=10
+        _write_block(22, row_payload.get("q2")) # V=22
+        _write_block(34, row_payload.get("q1")) # AH=34
+
+        # Copiar/ajustar fórmulas AU:BL desde fila 9 (plantilla base)
+        _copy_formulas(ws, DATA_START_ROW, r, FORMULA_START_COL, FORMULA_END_COL)
+        # Replicar estilo (bordes, fuente, locked)
+        _copy_row_styles(ws, DATA_START_ROW, ws, r, column_index_from_string(FORMULA_END_COL))
+
+        # --- FÓRMULAS DE RESULTADOS (T, U, AF, AG, AR, AS, AT) ---
+        # Estas fórmulas asumen que las columnas auxiliares (Q, S, AC...) ya existen y funcionan por _copy_formulas
+        # Ajustamos las fórmulas para la fila actual 'r'
+
+        # Q3: T (Caudal), U (Error) -> Cols 20, 21
+        ws.cell(row=r, column=20, value=f"=+O{r}/S{r}") # T = O/S
+        ws.cell(row=r, column=21, value=f"=+(((N{r}-M{r}-O{r})/O{r})*100)") # U
+
+        # Q2: AF (Caudal), AG (Error) -> Cols 32, 33
+        ws.cell(row=r, column=32, value=f"=+AA{r}/AE{r}") # AF = AA/AE
+        ws.cell(row=r, column=33, value=f"=+(((Z{r}-Y{r}-AA{r})/AA{r})*100)") # AG
+
+        # Q1: AR (Caudal), AS (Error) -> Cols 44, 45
+        ws.cell(row=r, column=44, value=f"=+AM{r}/AQ{r}") # AR = AM/AQ
+        ws.cell(row=r, column=45, value=f"=+(((AL{r}-AK{r}-AM{r})/AM{r})*100)") # AS
+
+        # AT: Conformidad -> Col 46
+        # Formula: =SI(I9>=1;"NO CONFORME";SI(BK9="SIGDIFERENTES";BC9;BL9))
+        ws.cell(row=r, column=46, value=f'=SI(I{r}>=1;"NO CONFORME";SI(BK{r}="SIGDIFERENTES";BC{r};BL{r}))')
+
+    # Borde inferior grueso de A a BL en la última fila de la bancada
+    _apply_thick_bottom_border(ws, start_row + nrows - 1, "A", FORMULA_END_COL)
+    return nrows
+
+def _bancada_nrows(b: Bancada) -> int:
+    rows_source = getattr(b, "rows_data", []) or []
+    return len(rows_source) if rows_source else int(getattr(b, "rows", 15) or 15)
+
+@dataclass
+class _CachedExport:
+    """Último libro generado para una OI (export incremental)."""
+    wb: Workbook
+    ws: Worksheet
+    # Datos de cabecera/globales: si cambian, se reconstruye el libro completo
+    header_key: tuple
+    estado_col: int
+    medidor_col: int
+    # Un elemento por bancada, en orden: (bancada_id, version, fila_inicio, n_filas)
+    layout: list[tuple[int, int, int, int]] = field(default_factory=list)
+    # Serializa parcheo + guardado de ESTE libro; exportaciones de otras OIs no esperan
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+# oi_id -> último libro generado (LRU acotado por settings.excel_cache_max_ois).
+# _CACHE_GUARD solo protege el diccionario, nunca se retiene durante la generación.
+_EXPORT_CACHE: "OrderedDict[int, _CachedExport]" = OrderedDict()
+_CACHE_GUARD = threading.Lock()
+
+def invalidate_excel_cache(oi_id: Optional[int] = None) -> None:
+    """Descarta el libro en caché de una OI (o de todas si `oi_id` es None)."""
+    with _CACHE_GUARD:
+        if oi_id is None:
+            _EXPORT_CACHE.clear()
+        else:
+            _EXPORT_CACHE.pop(oi_id, None)
+
+def _template_mtime() -> Optional[float]:
+    try:
+        return Path(get_settings().template_abs_path).stat().st_mtime
+    except OSError:
+        return None
+
+def _header_key(oi: OI, today_str: str, password: str | None) -> tuple:
+    # Incluye el mtime de la plantilla: si cambia el archivo, se reconstruye el libro
+    return (oi.q3, oi.alcance, oi.pma, oi.banco_id, oi.tech_number, today_str, bool(password), _template_mtime())
+
+def _build_full(oi: OI, rows: list[Bancada], header_key: tuple, today_str: str) -> _CachedExport:
     wb, _ws_active = _ensure_workbook()
     ws = _get_sheet(wb, SHEET_NAME)  # usar siempre "ERROR FINAL"
 
-    # Celdas fijas de cabecera (selección exacta desde listas)
-    q3_candidates = _iter_range_values(ws, Q3_RANGE)
-    alcance_candidates = _iter_range_values(ws, ALCANCE_RANGE)
-    # normalize_for_excel_list puede devolver None → forzamos str con ""
-    q3_value = find_exact_in_range(q3_candidates, normalize_for_excel_list(oi.q3) or "")
-    alcance_value = find_exact_in_range(alcance_candidates, normalize_for_excel_list(oi.alcance) or "")
+    # Celdas fijas de cabecera (selección exacta desde listas, vía índice de reglas)
+    rules = get_rules_index()
+    q3_value = rules.match_q3(oi.q3)
+    alcance_value = rules.match_alcance(oi.alcance)
     if q3_value is None:
         raise ValueError("Q3 no coincide con la lista de la plantilla")
     if alcance_value is None:
@@ -181,121 +362,42 @@ def generate_excel(oi: OI, bancadas: Iterable[Bancada], password: str | None = N
     if medidor_col is None:
         medidor_col = column_index_from_string("G")
 
-    # Escribir filas desde la 9
-    rows = list(bancadas)
-    # Ordenar por item si existe
-    rows.sort(key=lambda b: (b.item or 0))
-    
     # Datos globales para columnas B, C, D, E, H
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    presion_val = pma_to_pressure(oi.pma) if oi.pma else None
+    presion_val = get_rules_index().pressure_for(oi.pma) if oi.pma else None
 
+    cached = _CachedExport(wb=wb, ws=ws, header_key=header_key, estado_col=estado_col, medidor_col=medidor_col)
+    # Escribir filas desde la 9
     current_row = DATA_START_ROW
-    for i, b in enumerate(rows, start=1):
-        # 1. Detectar fuente de filas: ¿Tiene data del Grid (rows_data) o es legacy?
-        rows_source = getattr(b, "rows_data", []) or []
-        nrows = len(rows_source) if rows_source else int(getattr(b, "rows", 15) or 15)
-
-        # 2. Iterar fila por fila
-        for k in range(nrows):
-            r = current_row + k
-            # Obtener payload de la fila k (si existe)
-            row_payload = rows_source[k] if (rows_source and k < len(rows_source)) else {}
-
-            # Col A: Item incremental
-            item_value = current_row - DATA_START_ROW + 1 + k
-            ws.cell(row=r, column=1, value=item_value)
-
-            # Col B y C: Fechas
-            ws.cell(row=r, column=2, value=today_str)
-            ws.cell(row=r, column=3, value=today_str)
-
-            # Col D y E: Banco y Técnico
-            ws.cell(row=r, column=4, value=oi.banco_id)
-            ws.cell(row=r, column=5, value=oi.tech_number)
-
-            # Col G: Medidor (Prioridad: Fila > Bancada > Vacío)
-            val_medidor = row_payload.get("medidor") or b.medidor
-            if medidor_col:
-                ws.cell(row=r, column=medidor_col, value=val_medidor or "")
-
-            # --- LÓGICA DE REPLICACIÓN VERTICAL (FILA MAESTRA VS ESCLAVA) ---
-            # Si es la fila base (k=0), escribimos el valor.
-            # Si es fila esclava (k>0), escribimos referencia a la fila anterior (r-1).
-            
-            # Col H: Presión (Referencia Vertical)
-            if presion_val is not None:
-                if k == 0:
-                    ws.cell(row=r, column=8, value=presion_val)
-                else:
-                    ws.cell(row=r, column=8, value=f"=H{r-1}")
-
-            # Col I: Estado (Referencia Vertical según FORMULAS.txt)
-            if k == 0:
-                ws.cell(row=r, column=estado_col, value=(b.estado if b.estado is not None else 0))
-            else:
-                ws.cell(row=r, column=estado_col, value=f"=I{r-1}")
-
-            # --- ESCRITURA DE BLOQUES Q3 / Q2 / Q1 ---
-            def _write_block(start_col, block):
-                # c1..c7 -> offsets 0..6
-                # Columns: c1(Temp), c2(P.In), c3(P.Out), c4(LI), c5(LF), c6(Vol), c7(Time)
-                # Replicar: c1, c2, c3, c6, c7 (Indices 0,1,2,5,6)
-                # NO Replicar (Individuales): c4, c5 (Indices 3,4 -> L.I., L.F.)
-                
-                # Índices que deben ser referencia en filas esclavas
-                shared_indices = {0, 1, 2, 5, 6} 
-
-                if not block: block = {}
-
-                for idx, key in enumerate(["c1", "c2", "c3", "c4", "c5", "c6", "c7"]):
-                    val = block.get(key)
-                    target_col = start_col + idx
-                    col_letter = get_column_letter(target_col)
-                    
-                    # Regla: Si es fila > 0 Y el campo es compartido, poner fórmula "=J9"
-                    if k > 0 and idx in shared_indices:
-                        ws.cell(row=r, column=target_col, value=f"={col_letter}{r-1}")
-                    else:
-                        # Fila 0 o campo individual (LI/LF) -> Escribir valor
-                     if val is not None:
-                        ws.cell(row=r, column=target_col, value=val)
-
-            _write_block(10, row_payload.get("q3")) # J=10
-            _write_block(22, row_payload.get("q2")) # V=22
-            _write_block(34, row_payload.get("q1")) # AH=34
-
-            # Copiar/ajustar fórmulas AU:BL desde fila 9 (plantilla base)
-            _copy_formulas(ws, DATA_START_ROW, r, FORMULA_START_COL, FORMULA_END_COL)
-            # Replicar estilo (bordes, fuente, locked)
-            _copy_row_styles(ws, DATA_START_ROW, ws, r, column_index_from_string(FORMULA_END_COL))
-
-            # --- FÓRMULAS DE RESULTADOS (T, U, AF, AG, AR, AS, AT) ---
-            # Estas fórmulas asumen que las columnas auxiliares (Q, S, AC...) ya existen y funcionan por _copy_formulas
-            # Ajustamos las fórmulas para la fila actual 'r'
-            
-            # Q3: T (Caudal), U (Error) -> Cols 20, 21
-            ws.cell(row=r, column=20, value=f"=+O{r}/S{r}") # T = O/S
-            ws.cell(row=r, column=21, value=f"=+(((N{r}-M{r}-O{r})/O{r})*100)") # U
-            
-            # Q2: AF (Caudal), AG (Error) -> Cols 32, 33
-            ws.cell(row=r, column=32, value=f"=+AA{r}/AE{r}") # AF = AA/AE
-            ws.cell(row=r, column=33, value=f"=+(((Z{r}-Y{r}-AA{r})/AA{r})*100)") # AG
-            
-            # Q1: AR (Caudal), AS (Error) -> Cols 44, 45
-            ws.cell(row=r, column=44, value=f"=+AM{r}/AQ{r}") # AR = AM/AQ
-            ws.cell(row=r, column=45, value=f"=+(((AL{r}-AK{r}-AM{r})/AM{r})*100)") # AS
-
-            # AT: Conformidad -> Col 46
-            # Formula: =SI(I9>=1;"NO CONFORME";SI(BK9="SIGDIFERENTES";BC9;BL9))
-            ws.cell(row=r, column=46, value=f'=SI(I{r}>=1;"NO CONFORME";SI(BK{r}="SIGDIFERENTES";BC{r};BL{r}))')
-        
+    for b in rows:
+        nrows = _write_bancada_rows(ws, oi, b, current_row, estado_col, medidor_col, today_str, presion_val)
+        cached.layout.append((cast(int, b.id), b.version or 1, current_row, nrows))
         # Actualizar puntero global de filas
         current_row += nrows
-
-        # Borde inferior grueso de A a BL en la última fila de la bancada
-        _apply_thick_bottom_border(ws, current_row - 1, "A", FORMULA_END_COL)
-    
+    return cached
+
+def _patch_changed(cached: _CachedExport, oi: OI, rows: list[Bancada], today_str: str) -> bool:
+    """Reescribe solo las bancadas cuya versión cambió. Retorna False si la
+    distribución de filas ya no coincide (altas/bajas/cambio de n° de filas) y hay que reconstruir."""
+    if len(rows) != len(cached.layout):
+        return False
+    for b, (bid, _version, _start, nrows) in zip(rows, cached.layout):
+        if b.id != bid or _bancada_nrows(b) != nrows:
+            return False
+
+    presion_val = get_rules_index().pressure_for(oi.pma) if oi.pma else None
+    for i, b in enumerate(rows):
+        bid, version, start, nrows = cached.layout[i]
+        current = b.version or 1
+        if current == version:
+            continue
+        _write_bancada_rows(
+            cached.ws, oi, b, start, cached.estado_col, cached.medidor_col,
+            today_str, presion_val, clear_missing=True,
+        )
+        cached.layout[i] = (bid, current, start, nrows)
+    return True
+
+def _protect_and_save(wb: Workbook, password: str | None) -> bytes:
     # Proteger libro/estructura y hojas (usar hash en el workbook)
     if password:
         wb.security = WorkbookProtection(lockStructure=True)
@@ -303,11 +405,46 @@ def generate_excel(oi: OI, bancadas: Iterable[Bancada], password: str | None = N
         for sheet in wb.worksheets:
             sheet.protection.set_password(password)
             sheet.protection.enable()
-    
-    
+
     # Guardar en memoria
     buf = BytesIO()
     wb.save(buf)
-    buf.seek(0)
+    return buf.getvalue()
+
+def generate_excel(oi: OI, bancadas: Iterable[Bancada], password: str | None = None) -> Tuple[bytes, str]:
+    settings = get_settings()
+    rows = list(bancadas)
+    # Ordenar por item si existe
+    rows.sort(key=lambda b: (b.item or 0))
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    header_key = _header_key(oi, today_str, password)
     filename = f"{oi.code}.xlsx"
-    return buf.read(), filename
+    use_cache = settings.excel_incremental_export and oi.id is not None
+
+    # 1) Intentar parchear el libro en caché; el lock es el de ese libro (por OI)
+    cached: Optional[_CachedExport] = None
+    if use_cache:
+        with _CACHE_GUARD:
+            cached = _EXPORT_CACHE.get(cast(int, oi.id))
+            if cached is not None:
+                _EXPORT_CACHE.move_to_end(cast(int, oi.id))
+    if cached is not None and cached.header_key == header_key:
+        with cached.lock:
+            try:
+                if _patch_changed(cached, oi, rows, today_str):
+                    return _protect_and_save(cached.wb, password), filename
+            except Exception:
+                # Un parcheo a medias deja el libro inconsistente: descartarlo
+                invalidate_excel_cache(oi.id)
+                raise
+
+    # 2) Reconstrucción completa sin retener ningún lock (libro nuevo, aún no compartido)
+    cached = _build_full(oi, rows, header_key, today_str)
+    data = _protect_and_save(cached.wb, password)
+    if use_cache:
+        with _CACHE_GUARD:
+            _EXPORT_CACHE[cast(int, oi.id)] = cached
+            _EXPORT_CACHE.move_to_end(cast(int, oi.id))
+            while len(_EXPORT_CACHE) > max(settings.excel_cache_max_ois, 1):
+                _EXPORT_CACHE.popitem(last=False)
+    return data, filename
@@ -0,0 +1,344 @@
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from operator import itemgetter
+from typing import Any, List, Optional, Sequence, Tuple
+
+# Codificación compacta de `rows_data` (grid de una bancada).
+#
+# Formato (versión 2), little-endian:
+#   cabecera: b"VIR" | versión (u8) | flags (u8) | n_filas (u32)
+#   cuerpo (comprimido con zlib si flags & FLAG_ZLIB):
+#     fila:      n_filas × u8       bit0 clave "medidor" presente, bit1 medidor no nulo,
+#                                   bits2-4 clave q3/q2/q1 presente, bits5-7 bloque no nulo
+#     claves:    3 × n_filas × u8   por bloque, bit k = clave c{k+1} presente en el dict
+#     nulos:     3 × n_filas × u8   por bloque, bit k = c{k+1} presente con valor None
+#     enteros:   3 × n_filas × u8   por bloque, bit k = el valor de c{k+1} era int
+#     medidor:   n_filas × u8 (longitud utf-8) + textos concatenados
+#     valores:   3 bloques × 7 columnas × n_filas × f64 (0.0 si no hay valor), columna a columna
+#
+# Para filas que respetan el esquema (ver can_pack) el mapeo es exacto: se conservan
+# las claves presentes, los None y los enteros. Lo único que no se preserva es el
+# orden de las claves dentro de cada dict.
+#
+# Codificar/decodificar trabaja por columnas completas (array('d')) y arma cada bloque
+# con dict(zip(...)) cuando está completo (caso normal del grid), para no quedar más
+# lento que json.dumps/json.loads sobre el mismo grid.
+
+MAGIC = b"VIR"
+SCHEMA_VERSION = 2
+FLAG_ZLIB = 0x01
+# Body binario (no JSON): ver encode_frame/decode_frame
+PACKED_MEDIA_TYPE = "application/vnd.vi.packed"
+
+BLOCKS = ("q3", "q2", "q1")
+BLOCK_KEYS = ("c1", "c2", "c3", "c4", "c5", "c6", "c7")
+_ROW_KEYS = frozenset(("medidor",) + BLOCKS)
+_BLOCK_KEYS = frozenset(BLOCK_KEYS)
+_HEADER = struct.Struct("<3sBBI")
+_NKEYS = len(BLOCK_KEYS)
+_NCOLS = len(BLOCKS) * _NKEYS
+_ALL_KEYS = (1 << _NKEYS) - 1
+_FULL_ROW = 0xFF  # medidor y los tres bloques presentes y no nulos
+_ZEROS = (0.0,) * len(BLOCK_KEYS)
+_FLOAT_ONLY = {float}
+_CELL_TYPES = {float, int, type(None)}
+_block_values = itemgetter(*BLOCK_KEYS)
+# máscara de bits → claves con ese bit encendido (para no recorrer las 7 por bloque)
+_MASK_KEYS = tuple(tuple(k for i, k in enumerate(BLOCK_KEYS) if m >> i & 1) for m in range(1 << len(BLOCK_KEYS)))
+
+# Límites: acotan la memoria al decodificar blobs que vienen del cliente
+MAX_ROWS = 10_000
+MAX_MEDIDOR_BYTES = 255
+MAX_INT = 2 ** 53  # enteros representables exactamente en f64
+_MAX_ROW_BYTES = 1 + 3 * len(BLOCKS) + 1 + MAX_MEDIDOR_BYTES + 8 * _NCOLS
+# Nivel bajo: el grid es mayormente numérico y niveles altos casi no reducen más
+_ZLIB_LEVEL = 1
+
+
+def is_packed(data: Any) -> bool:
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:3]) == MAGIC
+
+
+def _encode(rows: Any) -> Optional[bytes]:
+    """Cuerpo sin comprimir, o None si `rows` no respeta el esquema (validación en la misma pasada)."""
+    if not isinstance(rows, list) or len(rows) > MAX_ROWS:
+        return None
+    n = len(rows)
+    row_mask = bytearray(n)
+    lengths = bytearray(n)
+    medidores: list[bytes] = []
+    for i, row in enumerate(rows):
+        if type(row) is not dict or not _ROW_KEYS.issuperset(row):
+            return None
+        mask = 0
+        if "medidor" in row:
+            mask = 0x01
+            medidor = row["medidor"]
+            if medidor is not None:
+                if type(medidor) is not str:
+                    return None
+                raw = medidor.encode("utf-8")
+                if len(raw) > MAX_MEDIDOR_BYTES:
+                    return None
+                mask = 0x03
+                lengths[i] = len(raw)
+                medidores.append(raw)
+        for b_idx, name in enumerate(BLOCKS):
+            if name in row:
+                mask |= 0x04 << b_idx
+                if row[name] is not None:
+                    mask |= 0x20 << b_idx
+        row_mask[i] = mask
+
+    masks: list[bytes] = []
+    null_masks: list[bytes] = []
+    int_masks: list[bytes] = []
+    columns: list[bytes] = []
+    for b_idx, name in enumerate(BLOCKS):
+        bit = 0x20 << b_idx
+        key_mask = bytearray(n)
+        null_mask = bytearray(n)
+        int_mask = bytearray(n)
+        # Una tupla de 7 valores por fila; se transpone a columnas al final
+        table: list = [_ZEROS] * n
+        for i, row in enumerate(rows):
+            if not row_mask[i] & bit:
+                continue
+            block = row[name]
+            if type(block) is not dict or not _BLOCK_KEYS.issuperset(block):
+                return None
+            if len(block) == _NKEYS:
+                vals = _block_values(block)
+                types = set(map(type, vals))
+                key_mask[i] = _ALL_KEYS
+                if types == _FLOAT_ONLY:
+                    # Caso normal: las 7 celdas con float finito
+                    if not all(map(math.isfinite, vals)):
+                        return None
+                    table[i] = vals
+                    continue
+                if not types <= _CELL_TYPES:
+                    return None
+                cells = list(vals)
+                for k_idx, val in enumerate(vals):
+                    if val is None:
+                        null_mask[i] |= 1 << k_idx
+                        cells[k_idx] = 0.0
+                    elif type(val) is int:
+                        if not -MAX_INT <= val <= MAX_INT:
+                            return None
+                        int_mask[i] |= 1 << k_idx
+                    elif not math.isfinite(val):
+                        return None
+                table[i] = cells
+                continue
+            cells = list(_ZEROS)
+            for k_idx, key in enumerate(BLOCK_KEYS):
+                if key not in block:
+                    continue
+                key_mask[i] |= 1 << k_idx
+                val = block[key]
+                t = type(val)
+                if t is float:
+                    if not math.isfinite(val):
+                        return None
+                    cells[k_idx] = val
+                elif val is None:
+                    null_mask[i] |= 1 << k_idx
+                elif t is int:
+                    if not -MAX_INT <= val <= MAX_INT:
+                        return None
+                    int_mask[i] |= 1 << k_idx
+                    cells[k_idx] = float(val)
+                else:
+                    return None
+            table[i] = cells
+        masks.append(bytes(key_mask))
+        null_masks.append(bytes(null_mask))
+        int_masks.append(bytes(int_mask))
+        if n:
+            columns.extend(_le_bytes(array("d", col)) for col in zip(*table))
+        else:
+            columns.extend(b"" for _ in BLOCK_KEYS)
+    return b"".join([bytes(row_mask), *masks, *null_masks, *int_masks, bytes(lengths), *medidores, *columns])
+
+
+def _le_bytes(col: array) -> bytes:
+    if sys.byteorder != "little":
+        col.byteswap()
+    return col.tobytes()
+
+
+def can_pack(rows: Optional[List[dict]]) -> bool:
+    """True si todas las filas respetan el esquema fijo (medidor + bloques q3/q2/q1 con c1..c7 numéricos)."""
+    return _encode(rows) is not None
+
+
+def pack_rows(rows: List[dict], compress: bool = True) -> bytes:
+    """Empaqueta `rows_data` en el formato binario. Lanza ValueError si no respeta el esquema."""
+    body = _encode(rows)
+    if body is None:
+        raise ValueError("rows_data no respeta el esquema empaquetable")
+    flags = 0
+    if compress:
+        packed = zlib.compress(body, _ZLIB_LEVEL)
+        # Solo conservar la compresión si realmente reduce tamaño
+        if len(packed) < len(body):
+            body, flags = packed, FLAG_ZLIB
+    return _HEADER.pack(MAGIC, SCHEMA_VERSION, flags, len(rows)) + body
+
+
+def _inflate(body: bytes, max_len: int) -> bytes:
+    """Descomprime con tope de salida: rechaza bombas zlib, streams truncados y basura final."""
+    d = zlib.decompressobj()
+    try:
+        out = d.decompress(body, max_len)
+    except zlib.error as e:
+        raise ValueError("rows_data empaquetado inválido") from e
+    if d.unconsumed_tail:
+        raise ValueError("rows_data empaquetado excede el tamaño máximo")
+    if not d.eof or d.unused_data:
+        raise ValueError("rows_data empaquetado inválido")
+    return out
+
+
+def _decode_block(cols: list, key_mask: bytes, null_mask: bytes, int_mask: bytes, i: int) -> dict:
+    """Bloque de la fila `i` cuando no es el caso completo (claves faltantes, None o int)."""
+    block = {}
+    km, nm, im = key_mask[i], null_mask[i], int_mask[i]
+    for k_idx, key in enumerate(BLOCK_KEYS):
+        bit = 1 << k_idx
+        if not km & bit:
+            continue
+        if nm & bit:
+            block[key] = None
+        elif im & bit:
+            block[key] = int(cols[k_idx][i])
+        else:
+            block[key] = cols[k_idx][i]
+    return block
+
+
+def unpack_rows(data: bytes) -> List[dict]:
+    """Decodifica un blob de `pack_rows` (mismas filas, salvo el orden de claves).
+    Lanza ValueError si el blob es inválido, demasiado grande o de una versión desconocida."""
+    data = bytes(data)
+    try:
+        magic, version, flags, n = _HEADER.unpack_from(data)
+    except struct.error as e:
+        raise ValueError("rows_data empaquetado inválido") from e
+    if magic != MAGIC:
+        raise ValueError("rows_data empaquetado inválido")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Versión de rows_data empaquetado no soportada: {version}")
+    if n > MAX_ROWS:
+        raise ValueError("rows_data empaquetado excede el máximo de filas")
+    body = data[_HEADER.size:]
+    max_len = n * _MAX_ROW_BYTES
+    if flags & FLAG_ZLIB:
+        body = _inflate(body, max_len)
+    elif len(body) > max_len:
+        raise ValueError("rows_data empaquetado excede el tamaño máximo")
+
+    nb = len(BLOCKS)
+    fixed = n * (2 + 3 * nb)
+    if len(body) < fixed:
+        raise ValueError("rows_data empaquetado inválido")
+    row_mask = body[:n]
+    key_masks = [body[n * (1 + b):n * (2 + b)] for b in range(nb)]
+    null_masks = [body[n * (1 + nb + b):n * (2 + nb + b)] for b in range(nb)]
+    int_masks = [body[n * (1 + 2 * nb + b):n * (2 + 2 * nb + b)] for b in range(nb)]
+    lengths = body[n * (1 + 3 * nb):fixed]
+    text_end = fixed + sum(lengths)
+    if len(body) != text_end + 8 * n * _NCOLS:
+        raise ValueError("rows_data empaquetado inválido")
+    try:
+        text = body[fixed:text_end].decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError("rows_data empaquetado inválido") from e
+    values = array("d", body[text_end:])
+    if sys.byteorder != "little":
+        values.byteswap()
+    values_list = values.tolist()
+
+    # Medidores: cortar el texto por caracteres si es ASCII (longitud en bytes == caracteres)
+    offsets = [0, *accumulate(lengths)]
+    if len(text) == text_end - fixed:
+        medidores = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    else:
+        raw = body[fixed:text_end]
+        medidores = [raw[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    full_rows = row_mask.count(_FULL_ROW) == n
+    # Bloques decodificados por columna; None = bloque nulo o ausente (lo resuelve row_mask)
+    blocks: list[list] = []
+    for b_idx in range(nb):
+        cols = [values_list[(b_idx * _NKEYS + k) * n:(b_idx * _NKEYS + k + 1) * n] for k in range(_NKEYS)]
+        km, nm, im = key_masks[b_idx], null_masks[b_idx], int_masks[b_idx]
+        if full_rows and km.count(_ALL_KEYS) == n and nm.count(0) == n and im.count(0) == n:
+            # Caso normal: todas las celdas con valor float
+            blocks.append([dict(zip(BLOCK_KEYS, vals)) for vals in zip(*cols)])
+            continue
+        bit = 0x20 << b_idx
+        out: list = [None] * n
+        for i, (vals, mask, keys, nulls, ints) in enumerate(zip(zip(*cols), row_mask, km, nm, im)):
+            if not mask & bit:
+                continue
+            if keys != _ALL_KEYS:
+                out[i] = _decode_block(cols, km, nm, im, i)
+                continue
+            block = dict(zip(BLOCK_KEYS, vals))
+            for key in _MASK_KEYS[nulls]:
+                block[key] = None
+            for key in _MASK_KEYS[ints]:
+                block[key] = int(block[key])
+            out[i] = block
+        blocks.append(out)
+
+    q3, q2, q1 = blocks
+    if full_rows:
+        return [{"medidor": m, "q3": a, "q2": b, "q1": c} for m, a, b, c in zip(medidores, q3, q2, q1)]
+    rows: List[dict] = []
+    for i in range(n):
+        mask = row_mask[i]
+        row: dict = {}
+        if mask & 0x01:
+            row["medidor"] = medidores[i] if mask & 0x02 else None
+        for b_idx, name in enumerate(BLOCKS):
+            if mask & (0x04 << b_idx):
+                row[name] = blocks[b_idx][i]
+        rows.append(row)
+    return rows
+
+
+# Trama del media type PACKED_MEDIA_TYPE:
+#   u32 (longitud del JSON) | JSON utf-8 con los metadatos | blobs concatenados
+# Cada objeto del JSON con "rows_packed": L consume, en orden de aparición, los
+# siguientes L bytes como su blob de pack_rows (rows_data va entonces en null).
+_FRAME = struct.Struct("<I")
+MAX_FRAME_META = 1 << 20
+
+
+def encode_frame(meta: Any, blobs: Sequence[bytes]) -> bytes:
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return _FRAME.pack(len(meta_bytes)) + meta_bytes + b"".join(blobs)
+
+
+def decode_frame(data: bytes) -> Tuple[Any, bytes]:
+    """Separa metadatos (JSON) y la zona de blobs de una trama."""
+    try:
+        (meta_len,) = _FRAME.unpack_from(data)
+    except struct.error as e:
+        raise ValueError("Trama empaquetada inválida") from e
+    if meta_len > MAX_FRAME_META or _FRAME.size + meta_len > len(data):
+        raise ValueError("Trama empaquetada inválida")
+    try:
+        meta = json.loads(data[_FRAME.size:_FRAME.size + meta_len].decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Trama empaquetada inválida") from e
+    return meta, bytes(data[_FRAME.size + meta_len:])
@@ -1,5 +1,6 @@
+from dataclasses import dataclass, field
 from datetime import date
-from typing import Optional, Iterable, List
+from typing import Dict, Optional, Iterable, List, Union
 
 # Reglas PMA -> Presión (bar) (valores cerrados)
 PMA_TO_PRESSURE = {
@@ -8,15 +9,9 @@ PMA_TO_PRESSURE = {
 
 }
 
-def pma_to_pressure(pma: Optional[float]) -> Optional[float]:
-    """Convierte PMA a Presión(bar). Devuelve None si no hay regla definida."""
-    if pma is None:
-        return None
-    try:
-        key = int(float(pma))
-    except (TypeError, ValueError):
-        return None
-    return PMA_TO_PRESSURE.get(key)
+# Listas por defecto si no hay plantilla (mismos valores que AZ2:BC2 / AZ1:BE1)
+DEFAULT_Q3_VALUES = [1.6, 2.5, 4, 6.3]
+DEFAULT_ALCANCE_VALUES = [100, 125, 160, 200, 400, 500]
 
 def iso_today() -> str:
     """Fecha actual en ISO YYYY-MM-DD."""
@@ -37,14 +32,60 @@ def normalize_for_excel_list(value: Optional[str | float | int]) -> Optional[str
             pass
     return s
 
-def find_exact_in_range(values: Iterable[str], desired: str) -> Optional[str]:
-    """Retorna el item exacto (texto) dentro de values que coincide con desired tras normalización."""
-    target = normalize_for_excel_list(desired)
-    if target is None:
+def rule_key(value: Optional[str | float | int]) -> Optional[Union[float, str]]:
+    """Clave normalizada para las listas de reglas: número (acepta coma o punto decimal,
+    de modo que 4, 4.0 y "4,0" coinciden) o texto en minúsculas si no es numérico."""
+    if value is None or isinstance(value, bool):
         return None
+    if isinstance(value, (int, float)):
+        return round(float(value), 6)
+    s = str(value).strip().replace(",", ".")
+    if not s:
+        return None
+    try:
+        return round(float(s), 6)
+    except ValueError:
+        return s.lower()
+
+@dataclass(frozen=True)
+class RulesIndex:
+    """Listas de la plantilla (Q3, Alcance) y regla PMA→Presión, indexadas una sola vez.
+    Cada lista guarda clave normalizada → texto canónico (tal como va a la celda del Excel)
+    y los valores en el orden de la plantilla (para /catalogs)."""
+    q3: Dict[Union[float, str], str] = field(default_factory=dict)
+    alcance: Dict[Union[float, str], str] = field(default_factory=dict)
+    q3_values: List[Union[float, int, str]] = field(default_factory=list)
+    alcance_values: List[Union[float, int, str]] = field(default_factory=list)
+    pma_pressure: Dict[int, float] = field(default_factory=lambda: dict(PMA_TO_PRESSURE))
+
+    def match_q3(self, value: Optional[str | float | int]) -> Optional[str]:
+        return self.q3.get(rule_key(value))  # type: ignore[arg-type]
+
+    def match_alcance(self, value: Optional[str | float | int]) -> Optional[str]:
+        return self.alcance.get(rule_key(value))  # type: ignore[arg-type]
+
+    def pressure_for(self, pma: Optional[float]) -> Optional[float]:
+        """Convierte PMA a Presión(bar). Devuelve None si no hay regla definida."""
+        if pma is None:
+            return None
+        try:
+            return self.pma_pressure.get(int(float(pma)))
+        except (TypeError, ValueError):
+            return None
+
+def _index_list(values: Iterable) -> tuple[Dict[Union[float, str], str], List[Union[float, int, str]]]:
+    lookup: Dict[Union[float, str], str] = {}
+    ordered: List[Union[float, int, str]] = []
     for v in values:
-        if v is None:
+        key = rule_key(v)
+        if key is None or key in lookup:
             continue
-        if str(v).strip() == target:
-            return str(v).strip()
-    return None
\ No newline at end of file
+        lookup[key] = normalize_for_excel_list(v) or ""
+        ordered.append(v.strip() if isinstance(v, str) else v)
+    return lookup, ordered
+
+def build_rules_index(q3_values: Iterable, alcance_values: Iterable) -> RulesIndex:
+    """Construye el índice a partir de los valores crudos de las listas de la plantilla."""
+    q3, q3_ordered = _index_list(q3_values)
+    alcance, alcance_ordered = _index_list(alcance_values)
+    return RulesIndex(q3=q3, alcance=alcance, q3_values=q3_ordered, alcance_values=alcance_ordered)
@@ -0,0 +1,40 @@
+import itertools
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Permite `import app...` al correr pytest desde backend/ o desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# BD principal y de archivo temporales para toda la sesión: se fijan antes de que
+# algún test importe app.core.db (que crea el engine al importarse).
+_TMP_DIR = tempfile.mkdtemp(prefix="vi-tests-")
+os.environ["VI_DB_PATH"] = str(Path(_TMP_DIR) / "vi.db")
+os.environ["VI_ARCHIVE_DB_PATH"] = str(Path(_TMP_DIR) / "vi_archive.db")
+
+_OI_SEQ = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def make_oi(client):
+    """Crea una OI válida (código único en la sesión) y retorna el JSON de la respuesta."""
+    def _make(**overrides) -> dict:
+        payload = {"code": f"OI-{next(_OI_SEQ):04d}-2025", "q3": 2.5, "alcance": 100, "pma": 16,
+                   "banco_id": 3, "tech_number": 101, **overrides}
+        r = client.post("/oi", json=payload)
+        assert r.status_code == 200, r.text
+        return r.json()
+    return _make
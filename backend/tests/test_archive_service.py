@@ -0,0 +1,167 @@
+import json
+import sqlite3
+import zlib
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import delete, func, select as sa_select
+from sqlmodel import Session, select
+
+from app import main
+from app.core import db
+from app.core.settings import get_settings
+from app.models import Bancada
+from app.services import archive_service, excel_service
+from app.services.rows_codec import PACKED_MEDIA_TYPE
+
+from test_db_migrations import BASELINE_SCHEMA
+
+
+def _grid(seed: int, rows: int = 3) -> list:
+    return [{"medidor": f"M{seed}-{k}", "q3": {"c1": 20 + seed, "c4": k * 1.5}, "q2": {"c2": k}, "q1": None}
+            for k in range(rows)]
+
+
+def _sheet_values(data: bytes) -> list:
+    return list(load_workbook(BytesIO(data)).worksheets[0].iter_rows(values_only=True))
+
+
+@pytest.fixture
+def archived_oi(client, make_oi):
+    """OI con 3 bancadas, cerrada y archivada con el barrido. Retorna (oi, respuestas previas)."""
+    oi = make_oi()
+    ids = []
+    for i in range(3):
+        r = client.post(f"/oi/{oi['id']}/bancadas", json={"rows": 3, "estado": i, "rows_data": _grid(i)})
+        ids.append(r.json()["id"])
+    assert client.post(f"/oi/{oi['id']}/close").status_code == 200
+    before = {
+        "full": client.get(f"/oi/{oi['id']}/full").json(),
+        "list": client.get(f"/oi/{oi['id']}/bancadas-list").json(),
+        "excel": client.post(f"/oi/{oi['id']}/excel", json={"password": "x"}).content,
+        "ids": ids,
+    }
+    r = client.post("/oi/archive", json={})
+    assert oi["id"] in r.json()["archived"]
+    return oi, before
+
+
+def _main_db_bancadas(oi_id: int) -> int:
+    with Session(db.engine) as s:
+        return len(s.exec(select(Bancada.id).where(Bancada.oi_id == oi_id)).all())
+
+
+def test_archived_oi_is_served_from_archive(client, archived_oi):
+    oi, before = archived_oi
+    assert _main_db_bancadas(oi["id"]) == 0
+
+    full = client.get(f"/oi/{oi['id']}/full").json()
+    assert full["archived_at"] is not None
+    assert {**full, "archived_at": None} == {**before["full"], "archived_at": None}
+    assert client.get(f"/oi/{oi['id']}/bancadas-list").json() == before["list"]
+
+    # Sin caché de Excel: el libro se reconstruye desde las bancadas del archivo
+    excel_service.invalidate_excel_cache()
+    r = client.post(f"/oi/{oi['id']}/excel", json={"password": "x"})
+    assert r.status_code == 200
+    assert _sheet_values(r.content) == _sheet_values(before["excel"])
+
+
+def test_archived_and_closed_oi_reject_edits(client, make_oi, archived_oi):
+    oi, before = archived_oi
+    for bid in before["ids"]:
+        assert client.put(f"/oi/bancadas/{bid}", json={"rows": 1}).status_code == 404
+        assert client.delete(f"/oi/bancadas/{bid}").status_code == 404
+    assert client.post(f"/oi/{oi['id']}/bancadas", json={"rows": 1}).status_code == 409
+
+    closed = make_oi()
+    bid = client.post(f"/oi/{closed['id']}/bancadas", json={"rows": 1}).json()["id"]
+    client.post(f"/oi/{closed['id']}/close")
+    assert client.put(f"/oi/bancadas/{bid}", json={"rows": 2}).status_code == 409
+    assert client.delete(f"/oi/bancadas/{bid}").status_code == 409
+    assert client.post(f"/oi/{closed['id']}/bancadas", json={"rows": 1}).status_code == 409
+
+
+def test_new_bancadas_do_not_reuse_archived_ids(client, make_oi, archived_oi):
+    _, before = archived_oi
+    other = make_oi()
+    new_id = client.post(f"/oi/{other['id']}/bancadas", json={"rows": 1}).json()["id"]
+    assert new_id > max(before["ids"])
+
+
+def test_missing_archive_row_returns_503(client, archived_oi):
+    oi, _ = archived_oi
+    with archive_service._archive_engine().begin() as conn:
+        conn.execute(delete(archive_service.oi_archive).where(archive_service.oi_archive.c.oi_id == oi["id"]))
+    archive_service._CACHE.clear()
+    for r in (
+        client.get(f"/oi/{oi['id']}/full"),
+        client.get(f"/oi/{oi['id']}/full", headers={"Accept": PACKED_MEDIA_TYPE}),
+        client.get(f"/oi/{oi['id']}/bancadas-list"),
+        client.post(f"/oi/{oi['id']}/excel", json={"password": "x"}),
+    ):
+        assert r.status_code == 503
+        assert r.json()["detail"] == "OI archivada no disponible"
+
+
+def test_sweep_reclaims_main_db_space(client, make_oi):
+    oi = make_oi()
+    for i in range(40):
+        client.post(f"/oi/{oi['id']}/bancadas", json={"rows": 100, "rows_data": _grid(i, rows=100)})
+    client.post(f"/oi/{oi['id']}/close")
+    db_path = Path(get_settings().db_path)
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    size_before = db_path.stat().st_size
+    assert oi["id"] in client.post("/oi/archive", json={}).json()["archived"]
+    assert db_path.stat().st_size < size_before
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA freelist_count").scalar() == 0
+
+
+@pytest.fixture
+def legacy_dbs(tmp_path, monkeypatch):
+    """BD principal con el esquema original (bancada sin AUTOINCREMENT) y archivo previo a max_bancada_id."""
+    main_path = tmp_path / "legacy.db"
+    con = sqlite3.connect(main_path)
+    con.executescript(BASELINE_SCHEMA)
+    con.execute("INSERT INTO oi VALUES (1, 'OI-0001-2025', 2.5, 100, 16, 25.6, 3, 101, '2025-01-01 00:00:00')")
+    con.execute("INSERT INTO bancada VALUES (1, 1, 1, NULL, 0, 1, NULL)")
+    con.commit()
+    con.close()
+
+    archive_path = tmp_path / "legacy_archive.db"
+    payload = [{"id": i, "oi_id": 2, "item": i, "medidor": None, "estado": 0, "rows": 1, "version": 1,
+                "rows_data": None} for i in (30, 40)]
+    con = sqlite3.connect(archive_path)
+    con.execute("CREATE TABLE oi_archive (oi_id INTEGER PRIMARY KEY, code VARCHAR NOT NULL, "
+                "archived_at DATETIME NOT NULL, payload BLOB NOT NULL)")
+    con.execute("INSERT INTO oi_archive VALUES (2, 'OI-0002-2025', '2025-02-01 00:00:00', ?)",
+                (zlib.compress(json.dumps(payload).encode()),))
+    con.commit()
+    con.close()
+
+    eng = db.make_sqlite_engine(main_path)
+    monkeypatch.setattr(db, "write_engine", eng.execution_options(sqlite_immediate=True))
+    monkeypatch.setattr(archive_service, "_engine", None)
+    monkeypatch.setattr(get_settings(), "archive_db_path", str(archive_path))
+    yield main_path
+    if archive_service._engine is not None:
+        archive_service._engine.dispose()
+    eng.dispose()
+
+
+def test_startup_keeps_ids_above_archived_max(legacy_dbs):
+    main._startup()
+    with archive_service._archive_engine().connect() as conn:
+        top = conn.execute(sa_select(func.max(archive_service.oi_archive.c.max_bancada_id))).scalar()
+    assert top == 40
+    con = sqlite3.connect(legacy_dbs)
+    new_id = con.execute("INSERT INTO bancada (oi_id, item, estado, rows, version) VALUES (1, 2, 0, 1, 1)").lastrowid
+    assert new_id > 40
+    # Arrancar de nuevo (otro worker) no cambia nada
+    con.commit()
+    main._startup()
+    assert con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'bancada'").fetchone()[0] == new_id
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, select
+
+from app.core.db import engine, write_session
+from app.core.settings import get_settings
+from app.models import AuthSession
+
+ADMIN = {"username": "admin", "password": "1234", "bancoId": 3}
+
+
+def _login(client) -> str:
+    r = client.post("/auth/login", json=ADMIN)
+    assert r.status_code == 200, r.text
+    return r.json()["token"]
+
+
+def _me(client, token: str):
+    return client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+
+def _get(token: str):
+    with Session(engine) as db:
+        return db.get(AuthSession, token)
+
+
+def _add(token: str, expires_at) -> None:
+    with write_session() as db:
+        db.add(AuthSession(token=token, username="admin", banco_id=3, tech_number=101,
+                           created_at=datetime.utcnow() - timedelta(days=2), expires_at=expires_at))
+        db.commit()
+
+
+def test_login_and_me(client):
+    token = _login(client)
+    r = _me(client, token)
+    assert r.status_code == 200
+    assert r.json()["username"] == "admin" and r.json()["bancoId"] == 3
+    sess = _get(token)
+    assert sess.expires_at - sess.created_at == timedelta(minutes=get_settings().session_ttl_minutes)
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer nope"}, {"Authorization": "Basic x"}])
+def test_me_rejects_missing_or_unknown_token(client, headers):
+    assert client.get("/auth/me", headers=headers).status_code == 401
+
+
+def test_login_rejects_bad_credentials(client):
+    assert client.post("/auth/login", json={**ADMIN, "password": "x"}).status_code == 401
+
+
+@pytest.mark.parametrize("expires_at", [datetime.utcnow() - timedelta(minutes=1), None])
+def test_expired_token_is_rejected_and_deleted(client, expires_at):
+    token = f"expired-{expires_at}"
+    _add(token, expires_at)
+    r = _me(client, token)
+    assert r.status_code == 401
+    assert r.json()["detail"] == "Sesión expirada"
+    assert _get(token) is None
+
+
+def test_login_purges_expired_sessions(client):
+    _add("stale", datetime.utcnow() - timedelta(hours=1))
+    _add("legacy", None)
+    _add("alive", datetime.utcnow() + timedelta(hours=1))
+    _login(client)
+    with Session(engine) as db:
+        tokens = set(db.exec(select(AuthSession.token)))
+    assert "stale" not in tokens and "legacy" not in tokens
+    assert "alive" in tokens
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect
+from sqlmodel import SQLModel
+
+from app.core import db
+
+# Esquema de la BD original (antes de version/closed_at/archived_at/authsession/AUTOINCREMENT)
+BASELINE_SCHEMA = """
+CREATE TABLE oi (
+    id INTEGER NOT NULL,
+    code VARCHAR NOT NULL,
+    q3 FLOAT NOT NULL,
+    alcance INTEGER NOT NULL,
+    pma INTEGER NOT NULL,
+    presion_bar FLOAT NOT NULL,
+    banco_id INTEGER NOT NULL,
+    tech_number INTEGER NOT NULL,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE bancada (
+    id INTEGER NOT NULL,
+    oi_id INTEGER NOT NULL,
+    item INTEGER NOT NULL,
+    medidor VARCHAR,
+    estado INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    rows_data JSON,
+    PRIMARY KEY (id),
+    FOREIGN KEY(oi_id) REFERENCES oi (id)
+);
+-- authsession tal como se creó antes de expires_at
+CREATE TABLE authsession (
+    token VARCHAR NOT NULL,
+    username VARCHAR NOT NULL,
+    banco_id INTEGER NOT NULL,
+    tech_number INTEGER NOT NULL,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (token)
+);
+"""
+
+GRID = [{"medidor": "M1", "q3": {"c1": 20.5, "c4": 3}, "q2": None}]
+# Ids con huecos: la migración debe conservarlos tal cual
+BANCADAS = [(1, 1, 1, "A", 0, 15, json.dumps(GRID)), (4, 1, 2, None, 3, 2, None), (9, 2, 1, "C", 5, 1, "[]")]
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    path = tmp_path / "legacy.db"
+    con = sqlite3.connect(path)
+    con.executescript(BASELINE_SCHEMA)
+    con.executemany("INSERT INTO oi VALUES (?, ?, 2.5, 100, 16, 25.6, 3, 101, '2025-01-01 00:00:00')",
+                    [(1, "OI-0001-2025"), (2, "OI-0002-2025")])
+    con.executemany("INSERT INTO bancada VALUES (?, ?, ?, ?, ?, ?, ?)", BANCADAS)
+    con.execute("INSERT INTO authsession VALUES ('tok', 'admin', 3, 101, '2025-01-01 00:00:00')")
+    con.commit()
+    con.close()
+    eng = db.make_sqlite_engine(path)
+    monkeypatch.setattr(db, "write_engine", eng.execution_options(sqlite_immediate=True))
+    yield path
+    eng.dispose()
+
+
+def test_init_db_migrates_baseline_schema(legacy_db):
+    db.init_db()
+    con = sqlite3.connect(legacy_db)
+    cols = lambda t: {r[1] for r in con.execute(f"PRAGMA table_info({t})")}
+    assert {"version"} <= cols("bancada")
+    assert {"closed_at", "archived_at"} <= cols("oi")
+    assert "expires_at" in cols("authsession")
+    ddl = con.execute("SELECT sql FROM sqlite_master WHERE name = 'bancada'").fetchone()[0]
+    assert "AUTOINCREMENT" in ddl.upper()
+    assert con.execute("SELECT name FROM sqlite_master WHERE name = 'bancada__old'").fetchone() is None
+
+    rows = con.execute("SELECT id, oi_id, item, medidor, estado, rows, rows_data, version FROM bancada ORDER BY id").fetchall()
+    assert [r[:7] for r in rows] == BANCADAS
+    assert all(r[7] == 1 for r in rows)
+    assert con.execute("SELECT token, expires_at FROM authsession").fetchall() == [("tok", None)]
+    assert con.execute("SELECT count(*) FROM oi").fetchone()[0] == 2
+
+
+def test_init_db_is_idempotent(legacy_db):
+    db.init_db()
+    con = sqlite3.connect(legacy_db)
+    before = con.execute("SELECT * FROM bancada ORDER BY id").fetchall()
+    ddl = con.execute("SELECT sql FROM sqlite_master WHERE name = 'bancada'").fetchone()[0]
+    con.close()
+    db.init_db()
+    con = sqlite3.connect(legacy_db)
+    assert con.execute("SELECT * FROM bancada ORDER BY id").fetchall() == before
+    assert con.execute("SELECT sql FROM sqlite_master WHERE name = 'bancada'").fetchone()[0] == ddl
+
+
+def test_ids_are_not_reused_after_migration(legacy_db):
+    db.init_db()
+    con = sqlite3.connect(legacy_db)
+    insert = "INSERT INTO bancada (oi_id, item, estado, rows, version) VALUES (1, 99, 0, 1, 1)"
+    assert con.execute(insert).lastrowid == 10
+    con.execute("DELETE FROM bancada WHERE id IN (9, 10)")
+    assert con.execute(insert).lastrowid == 11
+    con.commit()
+
+
+def test_reserve_ids_only_raises_sequence(legacy_db):
+    db.init_db()
+    db.reserve_ids("bancada", 50)
+    db.reserve_ids("bancada", 20)
+    con = sqlite3.connect(legacy_db)
+    assert con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'bancada'").fetchone()[0] == 50
+
+
+def test_models_match_migrated_tables(legacy_db):
+    db.init_db()
+    insp = inspect(db.write_engine)
+    for table in SQLModel.metadata.tables.values():
+        assert {c.name for c in table.columns} <= {c["name"] for c in insp.get_columns(table.name)}
@@ -0,0 +1,87 @@
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from app.models import OI, Bancada
+from app.services import excel_service
+
+
+def _oi() -> OI:
+    return OI(id=1, code="OI-0001-2025", q3=2.5, alcance=100, pma=16, presion_bar=25.6,
+              banco_id=3, tech_number=101)
+
+
+def _bancada(i: int, rows: int = 3, version: int = 1) -> Bancada:
+    rows_data = [
+        {"medidor": f"M{i}-{k}", "q3": {"c1": 20 + i, "c4": k * 10, "c5": k * 10 + 5},
+         "q2": {"c1": 1.5, "c4": k}, "q1": None}
+        for k in range(rows)
+    ]
+    return Bancada(id=i, oi_id=1, item=i, estado=0, rows=rows, version=version, rows_data=rows_data)
+
+
+def _values(data: bytes) -> list:
+    ws = load_workbook(BytesIO(data)).worksheets[0]
+    return list(ws.iter_rows(values_only=True))
+
+
+@pytest.fixture(autouse=True)
+def _clean_cache():
+    excel_service.invalidate_excel_cache()
+    yield
+    excel_service.invalidate_excel_cache()
+
+
+@pytest.fixture
+def full_builds(monkeypatch):
+    calls = []
+    original = excel_service._build_full
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(excel_service, "_build_full", counting)
+    return calls
+
+
+def test_patched_export_matches_full_rebuild(full_builds):
+    oi = _oi()
+    bancadas = [_bancada(i) for i in range(1, 5)]
+    excel_service.generate_excel(oi, bancadas, password="x")
+
+    # Editar una bancada: cambia medidor/estado y se vacían valores que antes existían
+    edited = _bancada(2, version=2)
+    edited.estado = 3
+    edited.rows_data = [{"medidor": "NUEVO", "q3": {"c1": 9}, "q2": None, "q1": {"c4": 7}}] * 3
+    bancadas[1] = edited
+
+    patched, _ = excel_service.generate_excel(oi, bancadas, password="x")
+    assert len(full_builds) == 1
+
+    excel_service.invalidate_excel_cache()
+    rebuilt, _ = excel_service.generate_excel(oi, bancadas, password="x")
+    assert len(full_builds) == 2
+    assert _values(patched) == _values(rebuilt)
+
+
+def test_row_count_change_triggers_full_rebuild(full_builds):
+    oi = _oi()
+    bancadas = [_bancada(i) for i in range(1, 4)]
+    excel_service.generate_excel(oi, bancadas)
+    bancadas[0] = _bancada(1, rows=4, version=2)
+    excel_service.generate_excel(oi, bancadas)
+    assert len(full_builds) == 2
+
+
+def test_template_change_triggers_full_rebuild(full_builds, monkeypatch):
+    oi = _oi()
+    bancadas = [_bancada(i) for i in range(1, 3)]
+    excel_service.generate_excel(oi, bancadas)
+    excel_service.generate_excel(oi, bancadas)
+    assert len(full_builds) == 1
+
+    monkeypatch.setattr(excel_service, "_template_mtime", lambda: 123.0)
+    excel_service.generate_excel(oi, bancadas)
+    assert len(full_builds) == 2
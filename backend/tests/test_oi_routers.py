@@ -0,0 +1,98 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+from app.api import oi, oi_async
+from app.core import db
+from app.core.settings import get_settings
+from app.services.rows_codec import PACKED_MEDIA_TYPE, decode_frame, encode_frame, pack_rows, unpack_rows
+
+
+def _routes(router) -> dict:
+    out = {}
+    for r in router.routes:
+        assert isinstance(r, APIRoute)
+        params = sorted(p.name for p in r.dependant.path_params + r.dependant.query_params)
+        for method in r.methods:
+            out[(method, r.path)] = (r.response_model, r.status_code, r.openapi_extra, params)
+    return out
+
+
+def test_async_router_mirrors_sync_router():
+    sync_routes, async_routes = _routes(oi.router), _routes(oi_async.router)
+    assert sync_routes.keys() == async_routes.keys()
+    for key, spec in sync_routes.items():
+        assert async_routes[key] == spec, key
+    # Mismo orden: /{oi_id}/... y /bancadas/{id} dependen de él para resolver rutas
+    assert [r.path for r in oi.router.routes] == [r.path for r in oi_async.router.routes]
+    assert all(asyncio.iscoroutinefunction(r.endpoint) for r in oi_async.router.routes)
+
+
+@pytest.fixture
+def async_app(client, monkeypatch):
+    """App cargada con VI_ASYNC_DB=true sobre la misma BD temporal que `client`."""
+    monkeypatch.setattr(get_settings(), "async_db", True)
+    # El engine async queda ligado a esta app; se descarta al terminar
+    monkeypatch.setattr(db, "_async_engine", None)
+    monkeypatch.setattr(db, "_async_write_engine", None)
+    path = Path(__file__).resolve().parents[1] / "app" / "main.py"
+    spec = importlib.util.spec_from_file_location("vi_main_async", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def test_async_app_smoke(async_app, monkeypatch):
+    opened = []
+    real = oi_async.async_session
+
+    def spy(write: bool = False):
+        opened.append(write)
+        return real(write=write)
+
+    monkeypatch.setattr(oi_async, "async_session", spy)
+    with TestClient(async_app) as c:
+        _smoke(c)
+    # Las peticiones pasaron por AsyncSession, de lectura y de escritura
+    assert True in opened and False in opened
+
+
+def _smoke(c: TestClient) -> None:
+    r = c.post("/oi", json={"code": "OI-9001-2025", "q3": 2.5, "alcance": 100, "pma": 16,
+                            "banco_id": 3, "tech_number": 101})
+    assert r.status_code == 200, r.text
+    oi_id = r.json()["id"]
+
+    grid = [{"medidor": "A1", "q3": {"c1": 20, "c2": 1.5}, "q2": None, "q1": {"c7": 3}}]
+    first = c.post(f"/oi/{oi_id}/bancadas", json={"rows": 1, "medidor": "A1", "rows_data": grid})
+    assert first.status_code == 200, first.text
+    blob = pack_rows(grid)
+    second = c.post(f"/oi/{oi_id}/bancadas", content=encode_frame({"rows": 1, "rows_packed": len(blob)}, [blob]),
+                    headers={"Content-Type": PACKED_MEDIA_TYPE})
+    assert second.status_code == 200, second.text
+    assert second.json()["item"] == 2
+
+    upd = c.put(f"/oi/bancadas/{first.json()['id']}", json={"rows": 2, "medidor": "A1-b", "rows_data": grid * 2})
+    assert upd.status_code == 200 and upd.json()["medidor"] == "A1-b"
+
+    full = c.get(f"/oi/{oi_id}/full").json()
+    assert [b["rows_data"] for b in full["bancadas"]] == [grid * 2, grid]
+    r = c.get(f"/oi/{oi_id}/full", headers={"Accept": PACKED_MEDIA_TYPE})
+    assert r.headers["content-type"] == PACKED_MEDIA_TYPE
+    meta, rest = decode_frame(r.content)
+    assert [b["id"] for b in meta["bancadas"]] == [b["id"] for b in full["bancadas"]]
+    assert unpack_rows(rest[:meta["bancadas"][0]["rows_packed"]]) == grid * 2
+    assert c.get(f"/oi/{oi_id}/bancadas-list").json() == full["bancadas"]
+
+    r = c.post(f"/oi/{oi_id}/excel", json={"password": "x"})
+    assert r.status_code == 200 and r.content[:2] == b"PK"
+
+    assert c.delete(f"/oi/bancadas/{second.json()['id']}").json() == {"ok": True}
+    assert c.post(f"/oi/{oi_id}/close").json()["closed_at"] is not None
+    assert c.put(f"/oi/bancadas/{first.json()['id']}", json={"rows": 1}).status_code == 409
+    assert c.post(f"/oi/{oi_id}/archive").json()["archived_at"] is not None
+    assert c.get(f"/oi/{oi_id}/bancadas-list").json() == full["bancadas"][:1]
@@ -0,0 +1,145 @@
+import struct
+import zlib
+
+import pytest
+
+from app.services import rows_codec
+from app.services.rows_codec import (
+    FLAG_ZLIB,
+    MAGIC,
+    MAX_ROWS,
+    SCHEMA_VERSION,
+    can_pack,
+    decode_frame,
+    encode_frame,
+    pack_rows,
+    unpack_rows,
+)
+
+
+def _rows() -> list:
+    return [
+        {"medidor": "M1", "q3": {"c1": 20, "c2": 1.25, "c4": None}, "q2": {}, "q1": None},
+        {"medidor": None, "q3": {"c1": -3, "c7": 2 ** 53}},
+        {"q1": {"c5": 0.1}},
+        {"medidor": "Ñandú-ü", "q3": None, "q2": {"c1": 1e300, "c2": -0.0}},
+        {},
+        {"medidor": "M5", "q3": {"c1": 1.5, "c2": None, "c3": 7, "c4": 0.0, "c5": -2, "c6": None, "c7": 9.75},
+         "q2": {f"c{k}": k / 4 for k in range(1, 8)}, "q1": {f"c{k}": k for k in range(1, 8)}},
+    ]
+
+
+def _full_grid(n: int) -> list:
+    return [{"medidor": f"M{i}", **{b: {f"c{k}": i + k / 8 for k in range(1, 8)} for b in ("q3", "q2", "q1")}}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip_is_exact(compress):
+    rows = _rows()
+    out = unpack_rows(pack_rows(rows, compress=compress))
+    assert out == rows
+    # Los enteros vuelven como int, no como float
+    assert type(out[0]["q3"]["c1"]) is int
+    assert type(out[0]["q3"]["c2"]) is float
+
+
+def test_round_trip_full_grid_and_non_ascii_medidor():
+    rows = _full_grid(50)
+    assert unpack_rows(pack_rows(rows)) == rows
+    rows[3]["medidor"] = "Ñ-ü"
+    assert unpack_rows(pack_rows(rows)) == rows
+
+
+def test_round_trip_empty_list():
+    assert unpack_rows(pack_rows([])) == []
+
+
+@pytest.mark.parametrize("rows", [
+    [{"medidor": "M", "extra": 1}],
+    [{"q3": {"c8": 1}}],
+    [{"q3": {"c1": "1"}}],
+    [{"q3": {"c1": True}}],
+    [{"q3": {f"c{k}": k == 1 or 1.0 for k in range(1, 8)}}],
+    [{"q3": {f"c{k}": float("nan") for k in range(1, 8)}}],
+    [{"q3": {"c1": 2 ** 53 + 1}}],
+    [{"q3": {"c1": float("inf")}}],
+    [{"medidor": "x" * 256}],
+    [{}] * (MAX_ROWS + 1),
+    "no-list",
+])
+def test_can_pack_rejects_out_of_schema(rows):
+    assert not can_pack(rows)
+    with pytest.raises(ValueError):
+        pack_rows(rows)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_truncated_blob_is_rejected(compress):
+    blob = pack_rows(_rows() * 10, compress=compress)
+    for cut in (2, 8, len(blob) // 2, len(blob) - 1):
+        with pytest.raises(ValueError):
+            unpack_rows(blob[:cut])
+
+
+def test_corrupt_blobs_are_rejected():
+    blob = pack_rows(_rows() * 10, compress=True)
+    assert blob[4] & FLAG_ZLIB
+    with pytest.raises(ValueError):
+        unpack_rows(b"XYZ" + blob[3:])
+    with pytest.raises(ValueError):
+        unpack_rows(blob[:3] + bytes([SCHEMA_VERSION + 1]) + blob[4:])
+    with pytest.raises(ValueError):
+        unpack_rows(blob[:12] + bytes(b ^ 0xFF for b in blob[12:]))
+    with pytest.raises(ValueError):
+        unpack_rows(blob + b"basura")
+
+
+def _header(n: int, flags: int = FLAG_ZLIB) -> bytes:
+    return struct.pack("<3sBBI", MAGIC, SCHEMA_VERSION, flags, n)
+
+
+def test_zlib_bomb_is_rejected(monkeypatch):
+    # 64 MiB de ceros comprimen a ~64 KiB; para 1 fila el cuerpo no puede pasar de unos cientos de bytes
+    bomb = zlib.compress(bytes(64 << 20), 9)
+    calls = []
+    original = zlib.decompressobj
+
+    def spy():
+        d = original()
+        real = d.decompress
+
+        class _Spy:
+            def decompress(self, data, max_length=0):
+                out = real(data, max_length)
+                calls.append((max_length, len(out)))
+                return out
+
+            def __getattr__(self, name):
+                return getattr(d, name)
+
+        return _Spy()
+
+    monkeypatch.setattr(rows_codec.zlib, "decompressobj", spy)
+    with pytest.raises(ValueError):
+        unpack_rows(_header(1) + bomb)
+    # Nunca se descomprimió más del tope para n filas
+    assert calls and all(0 < max_len and produced <= max_len for max_len, produced in calls)
+
+
+def test_row_count_is_capped():
+    with pytest.raises(ValueError):
+        unpack_rows(_header(2 ** 32 - 1) + zlib.compress(b""))
+    with pytest.raises(ValueError):
+        unpack_rows(_header(MAX_ROWS + 1, flags=0))
+
+
+def test_frame_round_trip_and_validation():
+    blob = pack_rows(_rows())
+    frame = encode_frame({"rows": 5, "rows_packed": len(blob)}, [blob])
+    meta, rest = decode_frame(frame)
+    assert meta == {"rows": 5, "rows_packed": len(blob)}
+    assert unpack_rows(rest) == _rows()
+    for bad in (b"", b"\x01\x00", struct.pack("<I", 100) + b"{}", struct.pack("<I", 2) + b"{x"):
+        with pytest.raises(ValueError):
+            decode_frame(bad)
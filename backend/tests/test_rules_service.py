@@ -0,0 +1,73 @@
+import pytest
+
+from app.services.excel_service import get_rules_index
+from app.services.rules_service import PMA_TO_PRESSURE, build_rules_index, rule_key
+
+
+@pytest.mark.parametrize("value", [4, 4.0, "4", "4,0", " 4.0 ", "4,000"])
+def test_rule_key_numeric_forms_match(value):
+    assert rule_key(value) == rule_key(4)
+
+
+def test_rule_key_text_and_empty():
+    assert rule_key(" ABC ") == "abc"
+    assert rule_key("") is None
+    assert rule_key(None) is None
+    assert rule_key(True) is None
+
+
+def test_rules_index_matches_template_text():
+    rules = build_rules_index(["1,6", "2,5", "4", "6,3", "4,0"], [100, "125", None])
+    # Se devuelve el texto canónico de la plantilla, con coma decimal
+    for value in (4, 4.0, "4,0", "4.0"):
+        assert rules.match_q3(value) == "4"
+    assert rules.match_q3(2.5) == "2,5"
+    assert rules.match_q3(5) is None
+    assert rules.q3_values == ["1,6", "2,5", "4", "6,3"]
+    assert rules.match_alcance("100") == "100"
+    assert rules.match_alcance(125.0) == "125"
+    assert rules.alcance_values == [100, "125"]
+
+
+def test_pressure_for_uses_pma_rule():
+    rules = build_rules_index([], [])
+    assert rules.pma_pressure == PMA_TO_PRESSURE
+    assert rules.pressure_for(16) == 25.6
+    assert rules.pressure_for("10") == 16.0
+    assert rules.pressure_for(12) is None
+    assert rules.pressure_for(None) is None
+    assert rules.pressure_for("x") is None
+
+
+@pytest.mark.parametrize("field, value, detail", [
+    ("q3", 3.3, "Q3 no coincide"),
+    ("alcance", 101, "Alcance no coincide"),
+    ("pma", 12, "PMA inválido"),
+])
+def test_create_oi_rejects_values_outside_rules(client, field, value, detail):
+    payload = {"code": "OI-9999-2025", "q3": 2.5, "alcance": 100, "pma": 16, "banco_id": 3, "tech_number": 1}
+    r = client.post("/oi", json={**payload, field: value})
+    assert r.status_code == 422
+    assert detail in r.json()["detail"]
+
+
+def test_create_oi_pma_message_lists_catalog(client):
+    r = client.post("/oi", json={"code": "OI-9999-2025", "q3": 2.5, "alcance": 100, "pma": 12,
+                                 "banco_id": 3, "tech_number": 1})
+    allowed = " o ".join(str(p) for p in sorted(get_rules_index().pma_pressure))
+    assert allowed in r.json()["detail"]
+
+
+def test_create_oi_accepts_equivalent_q3(make_oi):
+    rules = get_rules_index()
+    oi = make_oi(q3=4, pma=10)
+    assert rules.match_q3(oi["q3"]) is not None
+    assert oi["presion_bar"] == rules.pressure_for(10)
+
+
+def test_catalogs_match_rules_index(client):
+    rules = get_rules_index()
+    data = client.get("/catalogs").json()
+    assert data["q3"] == rules.q3_values
+    assert data["alcance"] == rules.alcance_values
+    assert data["pma"] == sorted(rules.pma_pressure)
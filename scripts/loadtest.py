@@ -0,0 +1,244 @@
+"""Prueba de carga local del backend en modo multi-worker.
+
+Para cada cantidad de workers levanta `uvicorn app.main:app --workers N` sobre una
+copia temporal de la BD y reproduce una mezcla de operaciones (login, guardado de
+bancadas, listados, OI completa y exportación Excel) desde varios hilos cliente.
+Imprime throughput y latencias por cantidad de workers.
+
+Uso (desde la raíz del repo):
+    python scripts/loadtest.py --workers 1,2,4 --duration 20 --concurrency 32
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+
+# Mezcla por defecto (pesos relativos), aproximando el uso real de las bancadas
+DEFAULT_MIX = "login=1,save=6,add=1,list=3,full=2,export=0.2"
+
+
+def _request(base: str, method: str, path: str, body: dict | None = None, token: str | None = None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            payload = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        status = e.code
+    # El Excel (zip, "PK...") y otras respuestas no JSON se devuelven como None
+    try:
+        return status, json.loads(payload) if payload and not payload.startswith(b"PK") else None
+    except ValueError:
+        return status, None
+
+
+def _grid(rows: int) -> list[dict]:
+    def block():
+        return {f"c{i}": round(random.uniform(0, 100), 3) for i in range(1, 8)}
+    return [{"medidor": f"M{random.randint(1, 99999)}", "q3": block(), "q2": block(), "q1": block()}
+            for _ in range(rows)]
+
+
+class Scenario:
+    """Estado compartido del escenario: OIs y bancadas creadas en la siembra."""
+
+    def __init__(self, base: str, ois: int, bancadas: int, rows: int):
+        self.base = base
+        self.rows = rows
+        self.token = ""
+        self.oi_ids: list[int] = []
+        self.bancada_ids: list[int] = []
+        self._seed(ois, bancadas)
+
+    def _seed(self, ois: int, bancadas: int) -> None:
+        status, sess = _request(self.base, "POST", "/auth/login",
+                                {"username": "admin", "password": "1234", "bancoId": 3})
+        if status != 200:
+            raise RuntimeError(f"No se pudo iniciar sesión: {status} {sess}")
+        self.token = sess["token"]
+        for n in range(ois):
+            status, oi = _request(self.base, "POST", "/oi", {
+                "code": f"OI-{n:04d}-2025", "q3": 2.5, "alcance": 100, "pma": 16,
+                "banco_id": 3, "tech_number": 101,
+            })
+            if status != 200:
+                raise RuntimeError(f"No se pudo sembrar la OI: {status} {oi}")
+            self.oi_ids.append(oi["id"])
+            for _ in range(bancadas):
+                status, b = _request(self.base, "POST", f"/oi/{oi['id']}/bancadas",
+                                     {"rows": self.rows, "rows_data": _grid(self.rows)})
+                if status != 200:
+                    raise RuntimeError(f"No se pudo sembrar la bancada: {status} {b}")
+                self.bancada_ids.append(b["id"])
+
+    def run(self, op: str) -> int:
+        oi_id = random.choice(self.oi_ids)
+        if op == "login":
+            status, _ = _request(self.base, "POST", "/auth/login",
+                                 {"username": "inspector", "password": "medileser", "bancoId": 4})
+            return status
+        if op == "save":
+            bid = random.choice(self.bancada_ids)
+            status, _ = _request(self.base, "PUT", f"/oi/bancadas/{bid}",
+                                 {"rows": self.rows, "estado": random.randint(0, 5), "rows_data": _grid(self.rows)})
+            return status
+        if op == "add":
+            status, _ = _request(self.base, "POST", f"/oi/{oi_id}/bancadas",
+                                 {"rows": self.rows, "rows_data": _grid(self.rows)})
+            return status
+        if op == "list":
+            return _request(self.base, "GET", "/oi?limit=50")[0]
+        if op == "full":
+            return _request(self.base, "GET", f"/oi/{oi_id}/full")[0]
+        if op == "export":
+            return _request(self.base, "POST", f"/oi/{oi_id}/excel", {"password": "1234"})[0]
+        raise ValueError(f"Operación desconocida: {op}")
+
+
+def _parse_mix(text: str) -> tuple[list[str], list[float]]:
+    ops, weights = [], []
+    for part in text.split(","):
+        name, _, w = part.partition("=")
+        ops.append(name.strip())
+        weights.append(float(w or 1))
+    return ops, weights
+
+
+def _wait_ready(base: str, proc: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn terminó antes de estar listo")
+        try:
+            if _request(base, "GET", "/health")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Timeout esperando a uvicorn")
+
+
+def _percentile_ms(sorted_latencies: list[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre latencias ya ordenadas (segundos → ms)."""
+    if not sorted_latencies:
+        return 0.0
+    idx = max(math.ceil(len(sorted_latencies) * pct) - 1, 0)
+    return round(sorted_latencies[idx] * 1000, 1)
+
+
+def run_for_workers(workers: int, args: argparse.Namespace) -> dict:
+    ops, weights = _parse_mix(args.mix)
+    port = args.port
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, VI_DB_PATH=str(Path(tmp) / "vi.db"))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            _wait_ready(base, proc)
+            scenario = Scenario(base, args.ois, args.bancadas, args.rows)
+            latencies: list[float] = []
+            statuses: dict[int, int] = {}
+            # Respuestas 2xx completadas dentro de la ventana de medición
+            ok_in_window = 0
+            lock = threading.Lock()
+            stop_at = time.time() + args.duration
+
+            def client() -> None:
+                nonlocal ok_in_window
+                rnd_ops = random.Random()
+                while time.time() < stop_at:
+                    op = rnd_ops.choices(ops, weights)[0]
+                    t0 = time.perf_counter()
+                    try:
+                        status = scenario.run(op)
+                    except OSError:
+                        status = 0
+                    dt = time.perf_counter() - t0
+                    in_window = time.time() <= stop_at
+                    with lock:
+                        latencies.append(dt)
+                        statuses[status] = statuses.get(status, 0) + 1
+                        if in_window and 200 <= status < 300:
+                            ok_in_window += 1
+
+            threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+            for t in threads:
+                t.start()
+            # Las peticiones en vuelo al cumplirse stop_at terminan, pero no suman al throughput
+            for t in threads:
+                t.join()
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    latencies.sort()
+    ok = sum(n for s, n in statuses.items() if 200 <= s < 300)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "rps": round(ok_in_window / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else 0.0,
+        "p95_ms": _percentile_ms(latencies, 0.95),
+        "p99_ms": _percentile_ms(latencies, 0.99),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="Lista de cantidades de workers a medir")
+    parser.add_argument("--duration", type=float, default=20, help="Segundos de carga por medición")
+    parser.add_argument("--concurrency", type=int, default=32, help="Hilos cliente concurrentes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ois", type=int, default=5, help="OIs sembradas")
+    parser.add_argument("--bancadas", type=int, default=10, help="Bancadas sembradas por OI")
+    parser.add_argument("--rows", type=int, default=15, help="Filas por bancada")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Pesos de operaciones: op=peso,...")
+    parser.add_argument("--csv", help="Guardar resultados en este CSV")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errores':>8}  status")
+    for n in [int(x) for x in args.workers.split(",") if x.strip()]:
+        r = run_for_workers(n, args)
+        results.append(r)
+        print(f"{r['workers']:>7} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['max_ms']:>8} {r['errors']:>8}  {r['statuses']}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["workers", "requests", "ok", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+            writer.writeheader()
+            for r in results:
+                writer.writerow({k: v for k, v in r.items() if k != "statuses"})
+
+
+if __name__ == "__main__":
+    main()